@@ -1,10 +1,10 @@
 import core
-import time
-import cwiid
 import launcher
+import periodic
 
 import os.path
 from ConfigParser import SafeConfigParser
+from hardware import cwiid
 
 
 class Calibration:
@@ -17,6 +17,7 @@ class Calibration:
         self.launcher = launcher_app
 
         self.ticks = 0
+        self.tick_time = 0.05
 
         # Define mode enums
         self.mode_none = 0
@@ -38,6 +39,10 @@ class Calibration:
             start point for the threaded challenge. """
         adjust_value = 5
 
+        # Run at a fixed rate to allow other stuff to happen
+        # and not over burden Pi and Arduino.
+        executor = periodic.PeriodicExecutor(self.tick_time)
+
         # Loop indefinitely, or until this thread is flagged as stopped.
         while self.wiimote and not self.killed:
 
@@ -97,9 +102,8 @@ class Calibration:
                 # Send motors "stick neutral" so that we can test centre value
                 self.core.throttle(0.0, 0.0)
 
-            # Sleep between loops to allow other stuff to
-            # happen and not over burden Pi and Arduino.
-            time.sleep(0.05)
+            self.ticks += 1
+            executor.wait()
 
     def read_config(self):
         """ Read the motor defaults from the config file. """
@@ -189,5 +193,5 @@ if __name__ == "__main__":
         # except (Exception, KeyboardInterrupt) as e:
         # Stop any active threads before leaving
         calibration.stop()
-        core.set_neutral()
+        core.shutdown()
         print("Quitting")
@@ -28,20 +28,28 @@
 """Ivmech PID Controller is simple implementation of a Proportional-Integral-Derivative (PID) Controller in the Python Programming Language.
 More information about PID Controller: http://en.wikipedia.org/wiki/PID_controller
 """
-import time
+from clock import monotonic
 
 class PID:
     """PID Controller
     """
 
-    def __init__(self, P=0.2, I=0.0, D=0.0):
+    def __init__(self, P=0.2, I=0.0, D=0.0, clock=monotonic):
 
         self.Kp = P
         self.Ki = I
         self.Kd = D
 
+        # Where the time between updates comes from, unless given to update()
+        self.clock = clock
+
+        # Derivative options, see setDerivativeOnMeasurement and
+        # setDerivativeFilter
+        self.derivative_on_measurement = False
+        self.derivative_filter = 0.0
+
         self.sample_time = 0.00
-        self.current_time = time.time()
+        self.current_time = self.clock()
         self.last_time = self.current_time
 
         self.clear()
@@ -54,6 +62,7 @@ class PID:
         self.ITerm = 0.0
         self.DTerm = 0.0
         self.last_error = 0.0
+        self.last_feedback = None
 
         # Windup Guard
         self.int_error = 0.0
@@ -61,7 +70,7 @@ class PID:
 
         self.output = 0.0
 
-    def update(self, feedback_value, ignore_d = False):
+    def update(self, feedback_value, dt = None, ignore_d = False):
         """Calculates PID value for given reference feedback
 
         .. math::
@@ -72,11 +81,20 @@ class PID:
 
            Test PID with Kp=1.2, Ki=1, Kd=0.001 (test_pid.py)
 
+        The time since the last update comes from the clock, unless dt
+        is given, eg. when running in simulated time.
         """
+        if isinstance(dt, bool):
+            # update(feedback, ignore_d) from before dt came second
+            raise TypeError("dt must be a number of seconds, pass ignore_d by name")
         error = self.SetPoint - feedback_value
 
-        self.current_time = time.time()
-        delta_time = self.current_time - self.last_time
+        if dt is None:
+            self.current_time = self.clock()
+            delta_time = self.current_time - self.last_time
+        else:
+            self.current_time = self.last_time + dt
+            delta_time = dt
         delta_error = error - self.last_error
 
         if (delta_time >= self.sample_time):
@@ -88,13 +106,26 @@ class PID:
             elif (self.ITerm > self.windup_guard):
                 self.ITerm = self.windup_guard
 
-            self.DTerm = 0.0
+            derivative = 0.0
             if delta_time > 0 and ignore_d == False:
-                self.DTerm = delta_error / delta_time
-
-            # Remember last time and last error for next calculation
+                if self.derivative_on_measurement:
+                    # No kick when the set point changes. Nothing to
+                    # compare against on the first update.
+                    if self.last_feedback is not None:
+                        derivative = (self.last_feedback - feedback_value) / delta_time
+                else:
+                    derivative = delta_error / delta_time
+
+                if self.derivative_filter > 0:
+                    # First order low pass
+                    alpha = delta_time / (self.derivative_filter + delta_time)
+                    derivative = self.DTerm + alpha * (derivative - self.DTerm)
+            self.DTerm = derivative
+
+            # Remember last time, error and feedback for next calculation
             self.last_time = self.current_time
             self.last_error = error
+            self.last_feedback = feedback_value
 
             self.output = self.PTerm + (self.Ki * self.ITerm) + (self.Kd * self.DTerm)
 
@@ -110,6 +141,16 @@ class PID:
         """Determines how aggressively the PID reacts to the current error with setting Derivative Gain"""
         self.Kd = derivative_gain
 
+    def setDerivativeOnMeasurement(self, enable):
+        """Take the derivative of the feedback rather than the error. The same
+        while the set point is steady, but without a spike when it changes."""
+        self.derivative_on_measurement = enable
+
+    def setDerivativeFilter(self, time_constant):
+        """Low pass filter the derivative with this time constant in seconds,
+        to stop it amplifying sensor noise. 0 turns the filter off."""
+        self.derivative_filter = time_constant
+
     def setWindup(self, windup):
         """Integral windup, also known as integrator windup or reset windup,
         refers to the situation in a PID feedback controller where
@@ -23,8 +23,9 @@
 # SOFTWARE.
 
 # import time
-import smbus
 from ctypes import *
+from hardware import SMBus, i2c_msg, load_tof_lib
+import i2c_arbiter
 
 VL53L0X_GOOD_ACCURACY_MODE = 0   # Good Accuracy mode
 VL53L0X_BETTER_ACCURACY_MODE = 1   # Better Accuracy mode
@@ -32,43 +33,107 @@ VL53L0X_BEST_ACCURACY_MODE = 2   # Best Accuracy mode
 VL53L0X_LONG_RANGE_MODE = 3   # Longe Range mode
 VL53L0X_HIGH_SPEED_MODE = 4   # High Speed mode
 
-i2cbus = smbus.SMBus(1)
+# Must match MAX_DEVICES in vl53l0x_python.c
+MAX_DEVICES = 16
 
+I2C_M_RD = 0x0001
 
-def i2c_read(address, reg, data_p, length):
-    """ i2c bus read callback """
-    ret_val = 0
-    result = []
+# Not on a TCA9548A multiplexer, as understood by vl53l0x_python.c
+TCA9548A_NONE = 255
+
+# Channel select byte last written to each TCA9548A, by mux address.
+# The library selects the channel before every transfer, so the select
+# is skipped when the channel is already selected.
+mux_selected = {}
+mux_switches = 0
+mux_skipped = 0
 
-    try:
-        result = i2cbus.read_i2c_block_data(address, reg, length)
-    except IOError:
-        ret_val = -1
+# The bus is shared with the OLED display (see launcher), so everything
+# goes through an arbiter that puts sensor reads first.
+arbiter = i2c_arbiter.BusArbiter(SMBus(1))
+i2cbus = arbiter.client("lidar", i2c_arbiter.PRIORITY_SENSOR)
 
-    if (ret_val == 0):
-        for index in range(length):
-            data_p[index] = result[index]
+# Transfer buffer and messages for the i2c_rdwr path, allocated once and
+# reused by every callback. The callbacks' length is a c_ubyte, so the
+# largest write is the register byte plus 255 data bytes.
+write_buf = (c_ubyte * 256)()
+if i2c_msg:
+    reg_msg = i2c_msg(addr=0, flags=0, len=1,
+                      buf=cast(write_buf, POINTER(c_char)))
+    read_msg = i2c_msg(addr=0, flags=I2C_M_RD, len=0, buf=None)
+    write_msg = i2c_msg(addr=0, flags=0, len=0,
+                        buf=cast(write_buf, POINTER(c_char)))
 
-    return ret_val
+
+def i2c_read(address, reg, data_p, length):
+    """ i2c bus read callback.
+
+        Sets the register pointer and reads in one combined transaction,
+        with the kernel filling the library's buffer directly. """
+    if i2c_msg:
+        write_buf[0] = reg
+        reg_msg.addr = address
+        read_msg.addr = address
+        read_msg.len = length
+        read_msg.buf = cast(data_p, POINTER(c_char))
+        try:
+            i2cbus.i2c_rdwr(reg_msg, read_msg)
+        except IOError:
+            return -1
+    else:
+        try:
+            result = i2cbus.read_i2c_block_data(address, reg, length)
+        except IOError:
+            return -1
+        memmove(data_p, bytes(bytearray(result)), length)
+
+    return 0
 
 
 def i2c_write(address, reg, data_p, length):
-    """ i2c bus write callback """
-    ret_val = 0
-    data = []
+    """ i2c bus write callback.
 
-    for index in range(length):
-        data.append(data_p[index])
-    try:
-        i2cbus.write_i2c_block_data(address, reg, data)
-    except IOError:
-        ret_val = -1
+        data_p may be NULL with a length of 0, eg. when the library selects
+        a TCA9548A channel, in which case only the register byte is sent. """
+    global mux_switches, mux_skipped
 
-    return ret_val
+    if address in mux_selected and length == 0:
+        # TCA9548A channel select. The library holds its mux lock around
+        # the select and the transfer that follows.
+        if mux_selected[address] == reg:
+            mux_skipped += 1
+            return 0
+        mux_switches += 1
+        try:
+            i2cbus.write_byte(address, reg)
+        except IOError:
+            # Don't know what the mux is set to any more
+            mux_selected[address] = None
+            return -1
+        mux_selected[address] = reg
+        return 0
+
+    if i2c_msg:
+        write_buf[0] = reg
+        if length:
+            memmove(addressof(write_buf) + 1, data_p, length)
+        write_msg.addr = address
+        write_msg.len = length + 1
+        try:
+            i2cbus.i2c_rdwr(write_msg)
+        except IOError:
+            return -1
+    else:
+        try:
+            i2cbus.write_i2c_block_data(address, reg, data_p[:length])
+        except IOError:
+            return -1
+
+    return 0
 
 
 # Load VL53L0X shared lib
-tof_lib = CDLL("./VL53L0X_rasp_python/bin/vl53l0x_python.so")
+tof_lib = load_tof_lib("./VL53L0X_rasp_python/bin/vl53l0x_python.so")
 
 # Create read function pointer
 READFUNC = CFUNCTYPE(c_int, c_ubyte, c_ubyte, POINTER(c_ubyte), c_ubyte)
@@ -82,14 +147,66 @@ write_func = WRITEFUNC(i2c_write)
 tof_lib.VL53L0X_set_i2c(read_func, write_func)
 
 
+def probe(address, TCA9548A_Num=TCA9548A_NONE, TCA9548A_Addr=0):
+    """ Return True if a VL53L0X answers at the given I2C address, behind
+        the given TCA9548A channel if any. Uses the library's own check,
+        the one startRanging makes before readdressing a device. """
+    if TCA9548A_Num < 8:
+        mux_selected.setdefault(TCA9548A_Addr, None)
+    return tof_lib.probeAddress(address, TCA9548A_Num, TCA9548A_Addr) == 1
+
+
+def mode_timing(mode):
+    """ Expected microseconds per measurement in a ranging mode, from the
+        library's own settings table. 0 for an unknown mode. """
+    return tof_lib.getModeTimingBudget(mode)
+
+
+# Buffers for read_all(), allocated once and refilled on every call
+distances_buf = (c_int32 * MAX_DEVICES)()
+statuses_buf = (c_int32 * MAX_DEVICES)()
+
+
+def read_all():
+    """ Read every started sensor with a single call into the library.
+
+        Returns a list of (distance, status) tuples indexed by object
+        number. Status is 0 for a valid measurement, the VL53L0X range
+        status if positive, or a negative API error code. """
+    count = VL53L0X.object_number
+    tof_lib.getDistances(distances_buf, statuses_buf, count)
+    return list(zip(distances_buf[:count], statuses_buf[:count]))
+
+
+# Buffer of object numbers for read_list()
+objects_buf = (c_int32 * MAX_DEVICES)()
+
+
+def read_list(objects):
+    """ Read the given object numbers, in the given order, with a single
+        call into the library. Returns a list of (distance, status) tuples
+        in the same order, see read_all. """
+    count = len(objects)
+    for index, object_number in enumerate(objects):
+        objects_buf[index] = object_number
+    tof_lib.getDistanceList(objects_buf, distances_buf, statuses_buf, count)
+    return list(zip(distances_buf[:count], statuses_buf[:count]))
+
+
 class VL53L0X(object):
     """VL53L0X ToF."""
 
     object_number = 0
 
-    def __init__(self, address=0x29, **kwargs):
+    def __init__(self, address=0x29, TCA9548A_Num=TCA9548A_NONE,
+                 TCA9548A_Addr=0, **kwargs):
         """Initialize the VL53L0X ToF Sensor from ST"""
         self.device_address = address
+        self.TCA9548A_Device = TCA9548A_Num
+        self.TCA9548A_Address = TCA9548A_Addr
+        if TCA9548A_Num < 8:
+            mux_selected.setdefault(TCA9548A_Addr, None)
+        self.mode = None
         self.my_object_number = VL53L0X.object_number
         VL53L0X.object_number += 1
 
@@ -98,8 +215,19 @@ class VL53L0X(object):
         tof_lib.startRanging(
             self.my_object_number,
             mode,
-            self.device_address
+            self.device_address,
+            self.TCA9548A_Device,
+            self.TCA9548A_Address
         )
+        self.mode = mode
+
+    def set_mode(self, mode):
+        """Switch a running sensor to another ranging mode without
+        reinitialising it. Returns True on success."""
+        if tof_lib.setRangingMode(self.my_object_number, mode) == 0:
+            self.mode = mode
+            return True
+        return False
 
     def stop_ranging(self):
         """Stop VL53L0X ToF Sensor Ranging"""
@@ -38,6 +38,7 @@ SOFTWARE.
 #define VERSION_REQUIRED_BUILD 2
 
 #define VL53L0X_DEFAULT_ADDRESS 0x29
+#define VL53L0X_MODEL_ID        0xEE
 
 #define VL53L0X_GOOD_ACCURACY_MODE      0   // Good Accuracy mode
 #define VL53L0X_BETTER_ACCURACY_MODE    1   // Better Accuracy mode
@@ -120,6 +121,150 @@ VL53L0X_Error WaitStopCompleted(VL53L0X_DEV Dev)
     return Status;
 }
     
+/******************************************************************************
+ * @brief   Ranging mode settings, indexed by mode
+ * @note    Every mode sets all of the values, so that a device can be
+ *          switched from one mode to another while running.
+ *****************************************************************************/
+typedef struct
+{
+    const char *name;
+    FixPoint1616_t signal_rate_limit;   // MCPS
+    FixPoint1616_t sigma_limit;         // mm
+    uint32_t timing_budget;             // us
+    uint8_t pre_range_vcsel_period;
+    uint8_t final_range_vcsel_period;
+} RangingModeSettings_t;
+
+static const RangingModeSettings_t RangingModeSettings[] =
+{
+    // VL53L0X_GOOD_ACCURACY_MODE
+    { "VL53L0X_GOOD_ACCURACY_MODE",
+        (FixPoint1616_t)(0.25*65536), (FixPoint1616_t)(18*65536), 33000, 14, 10 },
+    // VL53L0X_BETTER_ACCURACY_MODE
+    { "VL53L0X_BETTER_ACCURACY_MODE",
+        (FixPoint1616_t)(0.25*65536), (FixPoint1616_t)(18*65536), 66000, 14, 10 },
+    // VL53L0X_BEST_ACCURACY_MODE
+    { "VL53L0X_BEST_ACCURACY_MODE",
+        (FixPoint1616_t)(0.25*65536), (FixPoint1616_t)(18*65536), 200000, 14, 10 },
+    // VL53L0X_LONG_RANGE_MODE
+    { "VL53L0X_LONG_RANGE_MODE",
+        (FixPoint1616_t)(0.1*65536), (FixPoint1616_t)(60*65536), 33000, 18, 14 },
+    // VL53L0X_HIGH_SPEED_MODE
+    { "VL53L0X_HIGH_SPEED_MODE",
+        (FixPoint1616_t)(0.25*65536), (FixPoint1616_t)(32*65536), 20000, 14, 10 },
+};
+
+/******************************************************************************
+ * @brief   Timing budget of a ranging mode, so that callers can plan around
+ *          it without keeping their own copy of RangingModeSettings
+ * @param   mode - ranging mode
+ * @return  Microseconds per measurement, 0 if the mode is out of range
+ *****************************************************************************/
+uint32_t getModeTimingBudget(int mode)
+{
+    if (mode < VL53L0X_GOOD_ACCURACY_MODE || mode > VL53L0X_HIGH_SPEED_MODE)
+    {
+        return 0;
+    }
+    return RangingModeSettings[mode].timing_budget;
+}
+
+/******************************************************************************
+ * @brief   Apply the limit checks, timing budget and VCSEL periods of a
+ *          ranging mode to a device
+ * @param   Dev - device, which must not be measuring
+ * @param   mode - ranging mode, VL53L0X_GOOD_ACCURACY_MODE if out of range
+ * @return  API status
+ *****************************************************************************/
+static VL53L0X_Error setAccuracyMode(VL53L0X_DEV Dev, int mode)
+{
+    VL53L0X_Error Status = VL53L0X_ERROR_NONE;
+    const RangingModeSettings_t *pSettings;
+
+    if (mode < VL53L0X_GOOD_ACCURACY_MODE || mode > VL53L0X_HIGH_SPEED_MODE)
+    {
+        mode = VL53L0X_GOOD_ACCURACY_MODE;
+    }
+    pSettings = &RangingModeSettings[mode];
+    printf("%s\n", pSettings->name);
+
+    Status = VL53L0X_SetLimitCheckValue(Dev,
+                VL53L0X_CHECKENABLE_SIGNAL_RATE_FINAL_RANGE,
+                pSettings->signal_rate_limit);
+
+    if (Status == VL53L0X_ERROR_NONE)
+    {
+        Status = VL53L0X_SetLimitCheckValue(Dev,
+                    VL53L0X_CHECKENABLE_SIGMA_FINAL_RANGE,
+                    pSettings->sigma_limit);
+    }
+
+    if (Status == VL53L0X_ERROR_NONE)
+    {
+        Status = VL53L0X_SetMeasurementTimingBudgetMicroSeconds(Dev,
+                    pSettings->timing_budget);
+    }
+
+    if (Status == VL53L0X_ERROR_NONE)
+    {
+        Status = VL53L0X_SetVcselPulsePeriod(Dev,
+                    VL53L0X_VCSEL_PERIOD_PRE_RANGE,
+                    pSettings->pre_range_vcsel_period);
+    }
+
+    if (Status == VL53L0X_ERROR_NONE)
+    {
+        Status = VL53L0X_SetVcselPulsePeriod(Dev,
+                    VL53L0X_VCSEL_PERIOD_FINAL_RANGE,
+                    pSettings->final_range_vcsel_period);
+    }
+
+    return Status;
+}
+
+/******************************************************************************
+ * @brief   Check whether a VL53L0X answers at an I2C address
+ * @param   Dev - device to probe with, its address is restored afterwards
+ * @param   i2c_address - address to probe
+ * @return  1 if the model ID register reads back as a VL53L0X, else 0
+ *****************************************************************************/
+static int deviceAtAddress(VL53L0X_DEV Dev, uint8_t i2c_address)
+{
+    uint8_t saved_address = Dev->I2cDevAddr;
+    uint8_t model_id = 0;
+    VL53L0X_Error Status;
+
+    Dev->I2cDevAddr = i2c_address;
+    Status = VL53L0X_RdByte(Dev, VL53L0X_REG_IDENTIFICATION_MODEL_ID, &model_id);
+    Dev->I2cDevAddr = saved_address;
+
+    return (Status == VL53L0X_ERROR_NONE && model_id == VL53L0X_MODEL_ID);
+}
+
+/******************************************************************************
+ * @brief   Check whether a VL53L0X answers at an I2C address, without
+ *          starting an object for it, eg. while bringing sensors up
+ * @param   i2c_address - address to probe
+ * @param   TCA9548A_Device - Device number on TCA9548A I2C multiplexer if
+ *              being used. If not being used, set to 255.
+ * @param   TCA9548A_Address - Address of TCA9548A I2C multiplexer if
+ *              being used. If not being used, set to 0.
+ * @return  1 if the model ID register reads back as a VL53L0X, else 0
+ *****************************************************************************/
+int probeAddress(uint8_t i2c_address, uint8_t TCA9548A_Device, uint8_t TCA9548A_Address)
+{
+    VL53L0X_Dev_t Dev;
+
+    memset(&Dev, 0, sizeof(Dev));
+    Dev.I2cDevAddr = i2c_address;
+    Dev.TCA9548A_Device = TCA9548A_Device;
+    Dev.TCA9548A_Address = TCA9548A_Address;
+    VL53L0X_init(&Dev);
+
+    return deviceAtAddress(&Dev, i2c_address);
+}
+
 /******************************************************************************
  * @brief   Start Ranging
  * @param   mode - ranging mode
@@ -188,7 +333,15 @@ void startRanging(int object_number, int mode, uint8_t i2c_address, uint8_t TCA9
              */
 
             // If the requested address is not the default, change it in the device
-            if (i2c_address != VL53L0X_DEFAULT_ADDRESS)
+            if (i2c_address != VL53L0X_DEFAULT_ADDRESS &&
+                    deviceAtAddress(pMyDevice[object_number], i2c_address))
+            {
+                // The device keeps its address until it is reset, so it
+                // may still be set up from a previous run.
+                printf("Device already at I2C Address 0x%02X\n", i2c_address);
+                pMyDevice[object_number]->I2cDevAddr      = i2c_address;
+            }
+            else if (i2c_address != VL53L0X_DEFAULT_ADDRESS)
             {
                 printf("Setting I2C Address to 0x%02X\n", i2c_address);
                 // Address requested not default so set the address.
@@ -264,108 +417,7 @@ void startRanging(int object_number, int mode, uint8_t i2c_address, uint8_t TCA9
                                         if(Status == VL53L0X_ERROR_NONE)
                                         {
                                             // Set accuracy mode
-                                            switch (mode)
-                                            {
-                                                case VL53L0X_BEST_ACCURACY_MODE:
-                                                    printf("VL53L0X_BEST_ACCURACY_MODE\n");
-                                                    if (Status == VL53L0X_ERROR_NONE)
-                                                    {
-                                                        Status = VL53L0X_SetLimitCheckValue(pMyDevice[object_number],
-                                                            VL53L0X_CHECKENABLE_SIGNAL_RATE_FINAL_RANGE,
-                                                            (FixPoint1616_t)(0.25*65536));
-
-                                                        if (Status == VL53L0X_ERROR_NONE)
-                                                        {
-                                                            Status = VL53L0X_SetLimitCheckValue(pMyDevice[object_number],
-                                                                VL53L0X_CHECKENABLE_SIGMA_FINAL_RANGE,
-                                                                (FixPoint1616_t)(18*65536));
-
-                                                            if (Status == VL53L0X_ERROR_NONE)
-                                                            {
-                                                                Status = 
-                                                                    VL53L0X_SetMeasurementTimingBudgetMicroSeconds(pMyDevice[object_number], 200000);
-                                                            } 
-                                                        }
-                                                    }
-                                                    break;
-
-                                                case VL53L0X_LONG_RANGE_MODE:
-                                                    printf("VL53L0X_LONG_RANGE_MODE\n");
-                                                    if (Status == VL53L0X_ERROR_NONE)
-                                                    {
-                                                        Status = VL53L0X_SetLimitCheckValue(pMyDevice[object_number],
-                                                                    VL53L0X_CHECKENABLE_SIGNAL_RATE_FINAL_RANGE,
-                                                                    (FixPoint1616_t)(0.1*65536));
-                                            
-                                                        if (Status == VL53L0X_ERROR_NONE)
-                                                        {
-                                                            Status = VL53L0X_SetLimitCheckValue(pMyDevice[object_number],
-                                                                        VL53L0X_CHECKENABLE_SIGMA_FINAL_RANGE,
-                                                                        (FixPoint1616_t)(60*65536));
-                                                
-                                                            if (Status == VL53L0X_ERROR_NONE)
-                                                            {
-                                                                Status = 
-                                                                    VL53L0X_SetMeasurementTimingBudgetMicroSeconds(pMyDevice[object_number], 33000);
-                                                    
-                                                                if (Status == VL53L0X_ERROR_NONE)
-                                                                {
-                                                                    Status = VL53L0X_SetVcselPulsePeriod(pMyDevice[object_number], 
-                                                                                VL53L0X_VCSEL_PERIOD_PRE_RANGE, 18);
-                                                    
-                                                                    if (Status == VL53L0X_ERROR_NONE)
-                                                                    {
-                                                                        Status = VL53L0X_SetVcselPulsePeriod(pMyDevice[object_number], 
-                                                                                    VL53L0X_VCSEL_PERIOD_FINAL_RANGE, 14);
-                                                                    }
-                                                                }
-                                                            }
-                                                        }
-                                                    }
-                                                    break;
-
-                                                case VL53L0X_HIGH_SPEED_MODE:
-                                                    printf("VL53L0X_HIGH_SPEED_MODE\n");
-                                                    if (Status == VL53L0X_ERROR_NONE)
-                                                    {
-                                                        Status = VL53L0X_SetLimitCheckValue(pMyDevice[object_number],
-                                                                    VL53L0X_CHECKENABLE_SIGNAL_RATE_FINAL_RANGE,
-                                                                    (FixPoint1616_t)(0.25*65536));
-
-                                                        if (Status == VL53L0X_ERROR_NONE)
-                                                        {
-                                                            Status = VL53L0X_SetLimitCheckValue(pMyDevice[object_number],
-                                                                        VL53L0X_CHECKENABLE_SIGMA_FINAL_RANGE,
-                                                                        (FixPoint1616_t)(32*65536));
-
-                                                            if (Status == VL53L0X_ERROR_NONE)
-                                                            {
-                                                                Status = 
-                                                                    VL53L0X_SetMeasurementTimingBudgetMicroSeconds(pMyDevice[object_number], 20000);
-                                                            }
-                                                        }
-                                                    }
-                                                    break;
-
-                                                case VL53L0X_BETTER_ACCURACY_MODE:
-                                                    printf("VL53L0X_BETTER_ACCURACY_MODE\n");
-                                                    if (Status == VL53L0X_ERROR_NONE)
-                                                    {
-                                                        Status = 
-                                                            VL53L0X_SetMeasurementTimingBudgetMicroSeconds(pMyDevice[object_number], 66000);
-                                                    }
-                                                    break;
-
-                                                case VL53L0X_GOOD_ACCURACY_MODE:
-                                                default:
-                                                    printf("VL53L0X_GOOD_ACCURACY_MODE\n");
-                                                    if (Status == VL53L0X_ERROR_NONE)
-                                                    {
-                                                        Status = 
-                                                            VL53L0X_SetMeasurementTimingBudgetMicroSeconds(pMyDevice[object_number], 33000);
-                                                    }
-                                                    break;
-                                            }
+                                            Status = setAccuracyMode(pMyDevice[object_number], mode);
 
                                             if(Status == VL53L0X_ERROR_NONE)
                                             {
@@ -437,35 +489,58 @@ void startRanging(int object_number, int mode, uint8_t i2c_address, uint8_t TCA9
     }
 }
 
+/******************************************************************************
+ * @brief   Wait for and read the next measurement of a started object
+ * @param   object_number - object to read
+ * @param   pStatus - set to the range status of the measurement (0 is
+ *              valid), or the negative API error code if the read failed
+ * @return  Current distance in mm or -1 on error
+ *****************************************************************************/
+static int32_t readDistance(int object_number, int32_t *pStatus)
+{
+    VL53L0X_Error Status = VL53L0X_ERROR_NONE;
+    int32_t current_distance = -1;
+
+    Status = WaitMeasurementDataReady(pMyDevice[object_number]);
+
+    if(Status == VL53L0X_ERROR_NONE)
+    {
+        Status = VL53L0X_GetRangingMeasurementData(pMyDevice[object_number],
+                            pRangingMeasurementData);
+        if(Status == VL53L0X_ERROR_NONE)
+        {
+            current_distance = pRangingMeasurementData->RangeMilliMeter;
+            *pStatus = pRangingMeasurementData->RangeStatus;
+        }
+
+        // Clear the interrupt
+        VL53L0X_ClearInterruptMask(pMyDevice[object_number],
+                            VL53L0X_REG_SYSTEM_INTERRUPT_GPIO_NEW_SAMPLE_READY);
+        // VL53L0X_PollingDelay(pMyDevice[object_number]);
+    }
+
+    if(Status != VL53L0X_ERROR_NONE)
+    {
+        *pStatus = Status;
+    }
+
+    return current_distance;
+}
+
 /******************************************************************************
  * @brief   Get current distance in mm
  * @return  Current distance in mm or -1 on error
  *****************************************************************************/
 int32_t getDistance(int object_number)
 {
-    VL53L0X_Error Status = VL53L0X_ERROR_NONE;
     int32_t current_distance = -1;
+    int32_t status;
 
     if (object_number < MAX_DEVICES)
     {
         if (pMyDevice[object_number] != NULL)
         {
-            Status = WaitMeasurementDataReady(pMyDevice[object_number]);
-
-            if(Status == VL53L0X_ERROR_NONE)
-            {
-                Status = VL53L0X_GetRangingMeasurementData(pMyDevice[object_number],
-                                    pRangingMeasurementData);
-                if(Status == VL53L0X_ERROR_NONE)
-                {
-                    current_distance = pRangingMeasurementData->RangeMilliMeter;
-                }
-
-                // Clear the interrupt
-                VL53L0X_ClearInterruptMask(pMyDevice[object_number],
-                                    VL53L0X_REG_SYSTEM_INTERRUPT_GPIO_NEW_SAMPLE_READY);
-                // VL53L0X_PollingDelay(pMyDevice[object_number]);
-            }
+            current_distance = readDistance(object_number, &status);
         }
         else
         {
@@ -480,6 +555,132 @@ int32_t getDistance(int object_number)
     return current_distance;
 }
 
+/******************************************************************************
+ * @brief   Get current distance in mm of objects 0 to count-1 in one call
+ * @param   distances - array of count entries, filled with the distance in
+ *              mm of each object or -1 on error
+ * @param   statuses - array of count entries, filled with the range status
+ *              of each measurement (0 is valid), the negative API error
+ *              code if the read failed, or VL53L0X_ERROR_UNDEFINED if the
+ *              object has not been started
+ * @param   count - number of entries in both arrays
+ * @return  Number of objects read
+ *****************************************************************************/
+int getDistances(int32_t *distances, int32_t *statuses, int count)
+{
+    int object_number;
+    int read_count = 0;
+
+    if (count > MAX_DEVICES)
+    {
+        count = MAX_DEVICES;
+    }
+
+    for (object_number = 0; object_number < count; object_number++)
+    {
+        if (pMyDevice[object_number] != NULL)
+        {
+            distances[object_number] = readDistance(object_number,
+                                            &statuses[object_number]);
+            read_count++;
+        }
+        else
+        {
+            distances[object_number] = -1;
+            statuses[object_number] = VL53L0X_ERROR_UNDEFINED;
+        }
+    }
+
+    return read_count;
+}
+
+/******************************************************************************
+ * @brief   Get current distance in mm of a list of objects in one call
+ * @param   objects - array of count object numbers, read in that order
+ * @param   distances - array of count entries, filled as for getDistances
+ *              but in the order of objects
+ * @param   statuses - array of count entries, filled as for getDistances
+ *              but in the order of objects
+ * @param   count - number of entries in all three arrays
+ * @note    Lets the caller order reads, eg. to group objects on the same
+ *          TCA9548A channel together.
+ * @return  Number of objects read
+ *****************************************************************************/
+int getDistanceList(const int32_t *objects, int32_t *distances, int32_t *statuses, int count)
+{
+    int index;
+    int object_number;
+    int read_count = 0;
+
+    for (index = 0; index < count; index++)
+    {
+        object_number = objects[index];
+        if (object_number >= 0 && object_number < MAX_DEVICES &&
+                pMyDevice[object_number] != NULL)
+        {
+            distances[index] = readDistance(object_number, &statuses[index]);
+            read_count++;
+        }
+        else
+        {
+            distances[index] = -1;
+            statuses[index] = VL53L0X_ERROR_UNDEFINED;
+        }
+    }
+
+    return read_count;
+}
+
+/******************************************************************************
+ * @brief   Switch a started object to another ranging mode
+ * @param   mode - ranging mode, as for startRanging
+ * @note    Stops and restarts continuous ranging, but skips the device
+ *          initialisation and calibration that startRanging does.
+ * @return  API status, 0 on success
+ *****************************************************************************/
+int setRangingMode(int object_number, int mode)
+{
+    VL53L0X_Error Status = VL53L0X_ERROR_NONE;
+
+    if (object_number < MAX_DEVICES && pMyDevice[object_number] != NULL)
+    {
+        Status = VL53L0X_StopMeasurement(pMyDevice[object_number]);
+
+        if(Status == VL53L0X_ERROR_NONE)
+        {
+            Status = WaitStopCompleted(pMyDevice[object_number]);
+        }
+
+        if(Status == VL53L0X_ERROR_NONE)
+        {
+            Status = VL53L0X_ClearInterruptMask(pMyDevice[object_number],
+                VL53L0X_REG_SYSTEM_INTERRUPT_GPIO_NEW_SAMPLE_READY);
+        }
+
+        if(Status == VL53L0X_ERROR_NONE)
+        {
+            Status = setAccuracyMode(pMyDevice[object_number], mode);
+        }
+
+        if(Status == VL53L0X_ERROR_NONE)
+        {
+            Status = VL53L0X_StartMeasurement(pMyDevice[object_number]);
+        }
+
+        if(Status != VL53L0X_ERROR_NONE)
+        {
+            print_pal_error(Status);
+        }
+    }
+    else
+    {
+        printf("Object %d not initialized\n", object_number);
+        Status = VL53L0X_ERROR_UNDEFINED;
+    }
+
+    return Status;
+}
+
 /******************************************************************************
  * @brief   Stop Ranging
  *****************************************************************************/
@@ -510,6 +711,7 @@ void stopRanging(int object_number)
             print_pal_error(Status);
 
             free(pMyDevice[object_number]);
+            pMyDevice[object_number] = NULL;
         }
         else
         {
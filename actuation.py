@@ -0,0 +1,68 @@
+import threading
+import time
+
+
+class ActuationWorker():
+    """ Send motor commands from a thread of their own, so a control loop
+        can get on with sensing and computing its next tick while the
+        last tick's command goes out to the motors.
+
+        There is a single command slot. submit() overwrites whatever is
+        waiting in it, so if actuation falls behind the motors get the
+        newest command rather than working through a queue of stale
+        ones. Commands overwritten before being sent are counted in
+        self.dropped. """
+
+    def __init__(self, actuate):
+        """ Constructor. actuate is called with each command's arguments,
+            eg. core.throttle. """
+        self.actuate = actuate
+        self.condition = threading.Condition()
+        self.pending = None
+        self.killed = False
+        self.thread = None
+
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.busy_time = 0.0
+
+    def start(self):
+        """ Start the actuation thread. """
+        self.killed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Send any command still waiting, then stop the thread. """
+        with self.condition:
+            self.killed = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, *args):
+        """ Hand over a command to be sent as soon as possible. """
+        with self.condition:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = args
+            self.submitted += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.killed:
+                    self.condition.wait()
+                if self.pending is None:
+                    return
+                args = self.pending
+                self.pending = None
+
+            started = time.time()
+            self.actuate(*args)
+            self.busy_time += time.time() - started
+            self.sent += 1
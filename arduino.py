@@ -1,15 +1,325 @@
+""" Serial link to the Arduino running servocontrol.ino.
+
+    Commands normally go as binary frames:
+
+        SYNC (0xA5), message type, payload length, payload, CRC8
+
+    with little-endian payloads and the CRC (polynomial 0x07) taken over
+    the type, length and payload. A motor command is 8 bytes rather than
+    about 16 characters of text. After the sketch says hello at 9600 baud,
+    the two ends agree on a faster rate.
+
+    The sketch still understands the old "[type, a, b]" text commands,
+    and anything other than a sync byte is read as text. Set protocol to
+    PROTOCOL_TEXT (or PIWARS_SERIAL_PROTOCOL=text in the environment) to
+    talk to it that way, at 9600 baud.
+
+    Once connected, a background thread owns reading the port. It parses
+    everything that comes in and hands replies to whoever asked, so
+    nothing in a control loop ever waits on the Arduino. Commands go out
+    through a TransmitQueue on a thread of its own.
+
+    With the binary protocol, subscribe() has the sketch push its
+    battery voltage and motor outputs at a steady rate. The samples go
+    into a ring buffer, read with samples() or followed with stream(). """
+import collections
+import os
+import struct
+import threading
+import time
+
 import serial
 
+import telemetry
+from clock import monotonic
+
 MESSAGE_THROTTLE = 1
 MESSAGE_DIRECT = 2
 MESSAGE_CALIBRATE = 3
+MESSAGE_SENSOR = 4
+MESSAGE_BAUD = 5
+MESSAGE_PING = 6
+MESSAGE_SUBSCRIBE = 7
+MESSAGE_STREAM = 8
 
+PROTOCOL_TEXT = "text"
+PROTOCOL_BINARY = "binary"
+PROTOCOL = os.environ.get("PIWARS_SERIAL_PROTOCOL", PROTOCOL_BINARY)
+
+SYNC = 0xA5
+MAX_PAYLOAD = 16
+
+# The sketch always starts at SERIAL_BOARD_RATE
+SERIAL_BOARD_RATE = 9600
+BAUDRATE = 115200
+# Seconds the sketch waits for a frame at a new rate before dropping back
+BAUD_PROBATION = 1.0
+# Seconds to wait for a reply frame
+REPLY_TIMEOUT = 0.5
+# Seconds a sensor request may be outstanding before it's given up on
+SENSOR_TIMEOUT = 0.1
+# Seconds the reader thread blocks on the port at a time
+READ_TIMEOUT = 0.05
+
+# Stream frames: sketch millis, VSENSE, left and right actual micros, left
+# and right target micros, safety cutout
+STREAM_FORMAT = "<IHHHHHB"
+# Stream samples kept
+STREAM_CAPACITY = 500
+
+WRITING = telemetry.event("arduino_write", "Writing [%d, %d, %d]")
+WRITING_SENSOR = telemetry.event("arduino_write_sensor", "Writing [%d]")
+READ_SENSOR = telemetry.event("arduino_sensor", "Read sensor %d")
+TRANSMIT = telemetry.event(
+    "arduino_transmit", "Sent message %d, %.1fms old, %d waiting")
+
+
+def crc8_table():
+    """ Lookup table for CRC8 with polynomial 0x07. """
+    table = []
+    for byte in range(256):
+        crc = byte
+        for bit in range(8):
+            if crc & 0x80:
+                crc = ((crc << 1) ^ 0x07) & 0xFF
+            else:
+                crc = (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = crc8_table()
+
+
+def crc8(data):
+    """ CRC8 (polynomial 0x07, initial value 0) of some bytes. """
+    crc = 0
+    for byte in bytearray(data):
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_frame(message_type, payload=b""):
+    """ Wrap a payload up as a frame, ready to write. """
+    body = bytearray([message_type, len(payload)]) + bytearray(payload)
+    return bytes(bytearray([SYNC]) + body + bytearray([crc8(body)]))
+
+
+class FrameParser():
+    """ Pick frames out of a byte stream, a chunk at a time. Frames with
+        a bad CRC are dropped and counted in crc_errors. """
 
-class Arduino():
     def __init__(self):
+        """ Constructor """
+        self.buffer = bytearray()
+        self.crc_errors = 0
+
+    def feed(self, data):
+        """ Add received bytes. Returns a list of the (message type,
+            payload) of every complete frame. """
+        buffer = self.buffer
+        buffer.extend(bytearray(data))
+        frames = []
+        while True:
+            start = buffer.find(bytearray([SYNC]))
+            if start < 0:
+                del buffer[:]
+                break
+            del buffer[:start]
+            if len(buffer) < 3:
+                break
+            length = buffer[2]
+            if length > MAX_PAYLOAD:
+                # Not really a frame, look for the next sync byte
+                del buffer[:1]
+                continue
+            if len(buffer) < length + 4:
+                break
+            if crc8(buffer[1:length + 3]) != buffer[length + 3]:
+                self.crc_errors += 1
+                del buffer[:1]
+                continue
+            frames.append((buffer[1], bytes(buffer[3:length + 3])))
+            del buffer[:length + 4]
+        return frames
+
+
+class TransmitQueue():
+    """ Send commands to the serial port from a thread of their own,
+        keeping only the newest command of each message type.
+
+        Each command is written and then drained from the OS buffer
+        before the next is taken, so a backlog builds up here, where
+        submit() can overwrite it, rather than in the OS where the
+        motors would work through stale setpoints. Commands overwritten
+        before being sent are counted in self.dropped.
+
+        depth() is the number of commands waiting. last_age and max_age
+        are how long commands waited, in seconds, before being sent. """
+
+    def __init__(self, ser):
+        """ Constructor """
+        self.ser = ser
+        self.condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        # message type: (data, time submitted), oldest first
+        self.slots = collections.OrderedDict()
+        # Whether a command has been taken from its slot but not sent yet
+        self.busy = False
+        self.killed = False
+        self.thread = None
+
+        self.submitted = 0
+        self.sent = 0
+        self.dropped = 0
+        self.last_age = 0.0
+        self.max_age = 0.0
+
+    def start(self):
+        """ Start the transmit thread. """
+        self.killed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Send any commands still waiting, then stop the thread. Only
+            for shutting down: later commands raise IOError. """
+        with self.condition:
+            self.killed = True
+            self.condition.notify_all()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, message_type, data):
+        """ Hand over a command to be sent as soon as the line is free,
+            replacing any of the same type still waiting. """
+        with self.condition:
+            if self.killed or self.thread is None:
+                raise IOError("Arduino transmit thread isn't running")
+            if self.slots.pop(message_type, None) is not None:
+                self.dropped += 1
+            # Goes to the back, so commands still go out in the order
+            # they were last given
+            self.slots[message_type] = (data, monotonic())
+            self.submitted += 1
+            self.condition.notify_all()
+
+    def depth(self):
+        """ Number of commands waiting to be sent. """
+        return len(self.slots)
+
+    def flush(self, timeout=REPLY_TIMEOUT):
+        """ Wait until every command submitted so far has been sent, or
+            for timeout seconds. Returns whether they all went. """
+        deadline = monotonic() + timeout
+        with self.condition:
+            while self.slots or self.busy:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def write(self, data):
+        """ Write straight away, between queued commands, eg. a request
+            that mustn't be coalesced. """
+        with self.write_lock:
+            self.ser.write(data)
+            self.ser.flush()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.slots and not self.killed:
+                    self.condition.wait()
+                if not self.slots:
+                    return
+                message_type, (data, submitted) = \
+                    self.slots.popitem(last=False)
+                depth = len(self.slots)
+                self.busy = True
+
+            with self.write_lock:
+                self.last_age = monotonic() - submitted
+                self.max_age = max(self.max_age, self.last_age)
+                self.ser.write(data)
+                # Wait for it to go out, so that the next command waits
+                # in a slot rather than behind this one
+                self.ser.flush()
+            with self.condition:
+                self.busy = False
+                self.sent += 1
+                self.condition.notify_all()
+            telemetry.log(TRANSMIT, message_type, self.last_age * 1000, depth)
+
+
+class Reply():
+    """ The answer to a request, filled in later by the reader thread.
+        Like a future: wait() for the value, or pass a callback, which
+        is called on the reader thread so should be quick. """
+
+    def __init__(self, timeout, callback=None):
+        """ Constructor """
+        self.deadline = monotonic() + timeout
+        self.callback = callback
+        self.event = threading.Event()
+        self.value = None
+
+    def set(self, value):
+        self.value = value
+        self.event.set()
+        if self.callback:
+            self.callback(value)
+
+    def done(self):
+        return self.event.is_set()
+
+    def expired(self, now):
+        return not self.done() and now > self.deadline
+
+    def wait(self, timeout=None):
+        """ Wait for the value, at most until the request's deadline or
+            for timeout seconds. Returns None if it didn't arrive. """
+        if timeout is None:
+            timeout = max(0.0, self.deadline - monotonic())
+        self.event.wait(timeout)
+        return self.value
+
+
+class Arduino():
+    def __init__(self, protocol=PROTOCOL, baudrate=BAUDRATE):
+        """ Constructor. baudrate is the rate to ask for once connected,
+            when using the binary protocol. """
+        self.protocol = protocol
+        self.parser = FrameParser()
+
+        # Requests waiting for replies, oldest first. Binary requests are
+        # keyed by a tag the sketch echoes back. Text replies can't say
+        # what they answer, so they go to the oldest request.
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()
+        self.next_tag = 0
+        self.timeouts = 0
+        self.text_buffer = bytearray()
+
+        self.sensor_request = None
+        self.sensor_value = 0
+        self.sensor_time = None
+
+        # Stream samples, newest last, and how many have ever arrived
+        self.stream_condition = threading.Condition()
+        self.stream_samples = collections.deque(maxlen=STREAM_CAPACITY)
+        self.stream_count = 0
+        self.stream_period = 0.0
+
+        self.killed = False
+        self.thread = None
+
         self.ser = serial.Serial(
             "/dev/ttyUSB0",
-            baudrate=9600,
+            baudrate=SERIAL_BOARD_RATE,
             parity=serial.PARITY_NONE,
             stopbits=serial.STOPBITS_ONE,
             bytesize=serial.EIGHTBITS,
@@ -18,6 +328,7 @@ class Arduino():
             rtscts=False,
             dsrdtr=False,
             xonxoff=False)
+        self.transmit = TransmitQueue(self.ser)
 
         # Motors disabled by default. Its a safety thing.
         self.motors_enabled = False
@@ -25,7 +336,187 @@ class Arduino():
         while (self.ser.readline() == ""):
             print("Waiting for serial")
         print ("Got serial input, now we can continue")
-        self.ser.write("Hello")
+
+        if self.protocol == PROTOCOL_BINARY:
+            self.ser.timeout = REPLY_TIMEOUT
+            self.negotiate_baudrate(baudrate)
+        if self.protocol == PROTOCOL_BINARY:
+            print("Using binary protocol at %d baud" % self.ser.baudrate)
+        else:
+            self.ser.write("Hello")
+
+        self.ser.timeout = READ_TIMEOUT
+        self.start()
+
+    def start(self):
+        """ Start the reader and transmit threads. """
+        self.killed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+        self.transmit.start()
+
+    def flush(self, timeout=REPLY_TIMEOUT):
+        """ Wait for the commands already given to go out. """
+        return self.transmit.flush(timeout)
+
+    def stop(self):
+        """ Send any commands still waiting, then stop the reader and
+            transmit threads, when shutting down. Outstanding requests get
+            no reply, and later commands raise IOError. """
+        self.transmit.stop()
+        self.killed = True
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        next_expiry = monotonic() + READ_TIMEOUT
+        while not self.killed:
+            data = self.ser.read(self.ser.inWaiting() or 1)
+            # Time out requests whether or not anything arrives
+            now = monotonic()
+            if now >= next_expiry:
+                self.expire(now)
+                next_expiry = now + READ_TIMEOUT
+            if not data:
+                continue
+            if self.protocol == PROTOCOL_BINARY:
+                for frame_type, payload in self.parser.feed(data):
+                    self.handle_frame(frame_type, payload)
+            else:
+                self.text_buffer.extend(bytearray(data))
+                while b"\n" in self.text_buffer:
+                    end = self.text_buffer.index(b"\n") + 1
+                    line = bytes(self.text_buffer[:end])
+                    del self.text_buffer[:end]
+                    self.handle_line(line)
+
+    def handle_frame(self, frame_type, payload):
+        """ Deal with a frame from the sketch, on the reader thread. """
+        if frame_type == MESSAGE_SENSOR and len(payload) == 3:
+            tag, value = struct.unpack("<BH", payload)
+            self.sensor_reading(value)
+            self.resolve(tag, value)
+        elif frame_type == MESSAGE_STREAM and len(payload) == 15:
+            (millis, value, left_micros, right_micros,
+             left_target, right_target, cutout) = \
+                struct.unpack(STREAM_FORMAT, payload)
+            sample = (monotonic(), millis / 1000.0, value,
+                      left_micros, right_micros, left_target, right_target,
+                      bool(cutout))
+            with self.stream_condition:
+                self.stream_samples.append(sample)
+                self.stream_count += 1
+                self.stream_condition.notify_all()
+            self.sensor_reading(value)
+
+    def handle_line(self, line):
+        """ Deal with a line of text from the sketch. The only replies
+            are sensor readings. """
+        try:
+            value = int(line)
+        except ValueError:
+            print("Cannot parse message %r as number" % line)
+            return
+        self.sensor_reading(value)
+        self.resolve(None, value)
+
+    def sensor_reading(self, value):
+        self.sensor_value = value
+        self.sensor_time = monotonic()
+        telemetry.log(READ_SENSOR, value)
+
+    def expect(self, timeout, callback=None):
+        """ Register a request about to be sent. Returns (tag, Reply). """
+        reply = Reply(timeout, callback)
+        self.expire()
+        with self.lock:
+            tag = self.next_tag
+            self.next_tag = (self.next_tag + 1) % 256
+            self.pending[tag] = reply
+        return tag, reply
+
+    def resolve(self, tag, value):
+        """ Hand a reply to its request. Late replies are dropped. """
+        self.expire()
+        with self.lock:
+            if tag is None:
+                if not self.pending:
+                    return
+                tag = next(iter(self.pending))
+            reply = self.pending.pop(tag, None)
+        if reply:
+            reply.set(value)
+
+    def expire(self, now=None):
+        """ Give requests that are past their deadline None as their
+            reply, calling their callbacks, and forget them. """
+        if now is None:
+            now = monotonic()
+        expired = []
+        with self.lock:
+            for tag, reply in list(self.pending.items()):
+                if reply.expired(now):
+                    del self.pending[tag]
+                    expired.append(reply)
+            self.timeouts += len(expired)
+        for reply in expired:
+            reply.set(None)
+
+    def negotiate_baudrate(self, baudrate):
+        """ Ask the sketch to change baud rate, then follow it. Falls back
+            to the text protocol if the sketch doesn't answer. """
+        self.send_frame(MESSAGE_BAUD, struct.pack("<I", baudrate))
+        reply = self.read_frame(MESSAGE_BAUD)
+        if reply is None:
+            print("No reply to binary protocol, using text")
+            self.protocol = PROTOCOL_TEXT
+            self.ser.timeout = 10
+            return
+
+        accepted, = struct.unpack("<I", reply)
+        if accepted == self.ser.baudrate:
+            return
+        self.ser.baudrate = accepted
+
+        # Check we can hear each other at the new rate. If not, the
+        # sketch drops back by itself once its probation runs out.
+        self.send_frame(MESSAGE_PING, b"")
+        if self.read_frame(MESSAGE_PING) is None:
+            print("No reply at %d baud, dropping back" % accepted)
+            time.sleep(BAUD_PROBATION)
+            self.ser.baudrate = SERIAL_BOARD_RATE
+
+    def send_frame(self, message_type, payload):
+        """ Write a frame straight away, bypassing the queue. """
+        self.transmit.write(encode_frame(message_type, payload))
+
+    def read_frame(self, message_type):
+        """ Read until a frame of message_type arrives and return its
+            payload, or None if nothing more arrives in time. Other frames
+            are dropped. """
+        while True:
+            data = self.ser.read(1)
+            if not data:
+                return None
+            for frame_type, payload in self.parser.feed(data):
+                if frame_type == message_type:
+                    return payload
+
+    def encode(self, message_type, *values):
+        """ A command of unsigned 16 bit values, in whichever protocol is
+            in use. """
+        if self.protocol == PROTOCOL_BINARY:
+            payload = struct.pack("<%dH" % len(values), *values)
+            return encode_frame(message_type, payload)
+        fields = (message_type,) + values
+        return "[%s]\n" % ", ".join("%d" % f for f in fields)
+
+    def send(self, message_type, *values):
+        """ Queue a command, replacing any older one of the same type
+            that hasn't gone yet. """
+        self.transmit.submit(message_type, self.encode(message_type, *values))
 
     def enable_motors(self, enable):
         """ Called when we want to enable/disable the motors.
@@ -35,40 +526,99 @@ class Arduino():
     def throttle(self, left_micros, right_micros):
         """ Send motors command to change speed in servo
             microseconds using ramps. """
-        command = "[%d, %d, %d]\n" % \
-            (MESSAGE_THROTTLE, left_micros, right_micros)
-        self.ser.write(command)
-        print("Writing %s" % command)
+        self.send(MESSAGE_THROTTLE, left_micros, right_micros)
+        telemetry.log(WRITING, MESSAGE_THROTTLE, left_micros, right_micros)
 
     def direct_micros(self, left_micros, right_micros):
         """ Send motors speed in servo microseconds.
             WARNING: this method tells the motors
             to change speed IMEDIATELY without ramping. """
-        command = "[%d, %d, %d]\n" % \
-            (MESSAGE_DIRECT, left_micros, right_micros)
-        print("Writing %s" % command)
-        self.ser.write(command)
+        telemetry.log(WRITING, MESSAGE_DIRECT, left_micros, right_micros)
+        self.send(MESSAGE_DIRECT, left_micros, right_micros)
 
     def calibrate_motors(self, left_mid, right_mid):
         """ Not sure yet, I believe this method will
             send appropriate calibration speeds to ESC's
             so that they are properly calibrated. """
-        command = "[%d, %d, %d]\n" % (MESSAGE_CALIBRATE, left_mid, right_mid)
-        self.ser.write(command)
-        print("Writing %s" % command)
-
-    def read_sensor(self):
-        """ Read a sensor value and return it. """
-        command = "[4]"
-        self.ser.write(command)
-        print("Writing %s" % command)
-        s = self.ser.readline()  # Of the format "(A,xxx)\n"
-        s_value = s
-        print("Read sensor %s" % s_value)
-        try:
-            i_value = int(s_value)
-            return i_value
-        except:
-            print("Cannot parse message {} as number, returning 0"
-                  ).format(s_value)
-            return 0
+        self.send(MESSAGE_CALIBRATE, left_mid, right_mid)
+        telemetry.log(WRITING, MESSAGE_CALIBRATE, left_mid, right_mid)
+
+    def request_sensor(self, timeout=SENSOR_TIMEOUT, callback=None):
+        """ Ask for a sensor reading without waiting for it. Returns a
+            Reply, which gets the value or None after timeout seconds. """
+        tag, reply = self.expect(timeout, callback)
+        if self.protocol == PROTOCOL_BINARY:
+            self.send_frame(MESSAGE_SENSOR, struct.pack("<B", tag))
+        else:
+            # Each text request gets a reply, so don't coalesce them
+            self.transmit.write(self.encode(MESSAGE_SENSOR))
+        telemetry.log(WRITING_SENSOR, MESSAGE_SENSOR)
+        return reply
+
+    def read_sensor(self, wait=False):
+        """ Return the latest sensor value, asking for a new one if there
+            isn't a request out already. If wait is set, wait (up to
+            SENSOR_TIMEOUT) for the new value instead. 0 until the first
+            reading arrives.
+
+            While the stream is keeping the value fresh there's no need to
+            ask at all. """
+        if (self.stream_period and
+                self.sensor_age() < 2 * self.stream_period):
+            return self.sensor_value
+        request = self.sensor_request
+        if (request is None or request.done() or
+                request.expired(monotonic())):
+            request = self.sensor_request = self.request_sensor()
+        if wait:
+            request.wait()
+        return self.sensor_value
+
+    def sensor_age(self):
+        """ Seconds since the latest sensor value arrived. """
+        if self.sensor_time is None:
+            return float("inf")
+        return monotonic() - self.sensor_time
+
+    def subscribe(self, rate=50.0):
+        """ Have the sketch stream samples rate times a second, or stop if
+            rate is 0. Each takes 19 bytes of the link, so keep the rate
+            well under baud rate / 190. Returns False if the protocol in
+            use can't stream. """
+        if self.protocol != PROTOCOL_BINARY:
+            print("Streaming needs the binary protocol")
+            return False
+        period_ms = int(round(1000.0 / rate)) if rate else 0
+        self.stream_period = period_ms / 1000.0
+        self.send(MESSAGE_SUBSCRIBE, period_ms)
+        return True
+
+    def samples(self, count=None):
+        """ The newest count stream samples (all those kept if None),
+            oldest first. Each is (time received, sketch time in seconds,
+            VSENSE, left micros, right micros, left target micros, right
+            target micros, safety cutout on). """
+        with self.stream_condition:
+            samples = list(self.stream_samples)
+        if count is not None:
+            samples = samples[-count:]
+        return samples
+
+    def stream(self, timeout=1.0):
+        """ Iterate over stream samples as they arrive, starting with the
+            next one. Stops if none arrives for timeout seconds. Samples
+            overwritten in the ring buffer before being reached are
+            skipped. """
+        with self.stream_condition:
+            seen = self.stream_count
+        while True:
+            with self.stream_condition:
+                if self.stream_count == seen:
+                    self.stream_condition.wait(timeout)
+                new = min(self.stream_count - seen, len(self.stream_samples))
+                if not new:
+                    return
+                samples = list(self.stream_samples)[-new:]
+                seen = self.stream_count
+            for sample in samples:
+                yield sample
@@ -0,0 +1,291 @@
+""" Relay feedback autotuning of the wall following PID.
+
+    Instead of the PID, a relay steers the robot: hard towards the wall
+    when it's too far away, hard away when it's too close. The loop
+    settles into a steady oscillation, and comparing the error with the
+    relay output over each cycle measures how the robot responds to
+    steering at that frequency.
+
+    Steering changes the heading, which changes the distance, so the
+    distance is a double integrator of the relay output and a plain
+    relay just oscillates ever wider. The relay acts on the error plus a
+    lead times its rate of change instead, which damps the loop enough
+    to settle into a steady oscillation.
+
+    The response is measured from the fundamental (first Fourier
+    component) of the error and of the relay output over whole cycles.
+    Unlike the usual describing function estimate from the oscillation's
+    peaks, that is exact for a linear process and averages out sensor
+    noise. Taking the process to be a double integrator with a little
+    delay, the measurement gives its gain and delay, and the PID gains
+    are worked out to give the loop a chosen crossover frequency and
+    phase margin (Astrom and Hagglund's phase margin design).
+
+    Run as a script with "sim" to tune against wall_plant's model in a
+    couple of seconds, or with no arguments to tune on the robot. """
+from __future__ import division
+import cmath
+import math
+import sys
+
+import periodic
+
+# Tuning rules: loop crossover frequency (rad/s) and phase margin
+# (degrees). Much faster than these and steering saturates for the
+# offsets seen when starting a run.
+RULES = {
+    'cautious': (0.5, 65.0),
+    'moderate': (0.7, 65.0),
+    'fast': (0.8, 65.0),
+}
+
+# Integral time as a multiple of the derivative time
+INTEGRAL_RATIO = 4.0
+
+# Seconds of rate of change added to the relay's input
+LEAD = 0.8
+# Relay hysteresis (mm), well clear of the lidar noise
+HYSTERESIS = 20.0
+# Time constant (s) of the low pass filter on the relay's input
+INPUT_FILTER = 0.1
+
+
+class RelayTuner():
+    """ The relay and its measurements, independent of the robot.
+
+        Feed update() the error each tick (feedback minus set point, as
+        WallFollower gives PID.update) and its rate of change, and apply
+        the relay output it returns as if it came from the PID. The relay
+        input is the error, low pass filtered with time constant
+        filter_time, plus lead * rate. The output switches between
+        +amplitude and -amplitude each time the input passes hysteresis
+        the other side of zero.
+
+        The first cycle is a transient and ignored. Once cycles full
+        periods after it have been measured, done() is true. """
+
+    def __init__(self, amplitude, hysteresis=HYSTERESIS, cycles=3, lead=0.0,
+                 filter_time=0.0):
+        """ Constructor """
+        self.amplitude = amplitude
+        self.hysteresis = hysteresis
+        self.cycles = cycles
+        self.lead = lead
+        self.filter_time = filter_time
+
+        self.state = 0
+        self.filtered = None
+        self.last_time = None
+        self.last_rise = None
+
+        # (time step, error, output) through the current cycle
+        self.samples = []
+
+        # Per full cycle, oldest first: period, and the process's
+        # frequency response at that period as a complex number
+        self.periods = []
+        self.responses = []
+
+    def update(self, error, now, rate=0.0):
+        """ Take the error and its rate of change (per second) at time now
+            (seconds), return the relay output. """
+        if self.filtered is None:
+            self.filtered = error
+            dt = 0.0
+        else:
+            dt = now - self.last_time
+            if self.filter_time > 0:
+                self.filtered += dt / (self.filter_time + dt) * (error - self.filtered)
+            else:
+                self.filtered = error
+        self.last_time = now
+        signal = self.filtered + self.lead * rate
+
+        if self.state == 0:
+            # Start by pushing against the initial error
+            self.state = -1 if signal > 0 else 1
+        elif self.state > 0 and signal > self.hysteresis:
+            self.state = -1
+            # A full cycle ends each time the input rises through the band
+            if self.last_rise is not None:
+                period = now - self.last_rise
+                self.periods.append(period)
+                self.responses.append(self.response(self.samples, period))
+            self.last_rise = now
+            self.samples = []
+        elif self.state < 0 and signal < -self.hysteresis:
+            self.state = 1
+
+        output = self.state * self.amplitude
+        if self.last_rise is not None:
+            self.samples.append((dt, error, output))
+        return output
+
+    def response(self, samples, period):
+        """ The process's response at the frequency of one cycle: the
+            fundamental of the error over the fundamental of the relay
+            output. """
+        omega = 2 * math.pi / period
+        elapsed = 0.0
+        error_sum = 0j
+        output_sum = 0j
+        for dt, error, output in samples:
+            rotation = cmath.exp(-1j * omega * elapsed) * dt
+            error_sum += error * rotation
+            output_sum += output * rotation
+            elapsed += dt
+        return error_sum / output_sum
+
+    def done(self):
+        # One more than asked for, to drop the first
+        return len(self.periods) > self.cycles
+
+    def process(self):
+        """ Return (gain, delay in seconds) of the process, as a double
+            integrator with a delay, from the cycles measured so far,
+            ignoring the first. """
+        periods = self.periods[1:]
+        responses = self.responses[1:]
+        if not periods:
+            raise ValueError("No complete relay cycles yet")
+
+        omega = 2 * math.pi / (sum(periods) / len(periods))
+        response = sum(responses) / len(responses)
+        # A double integrator's response is -gain / omega^2, anything
+        # beyond the 180 degrees of lag is down to delay
+        gain = abs(response) * omega ** 2
+        delay = max(0.0, -cmath.phase(-response) / omega)
+        return gain, delay
+
+    def gains(self, rule='moderate'):
+        """ Return PID (Kp, Ki, Kd) by the given rule, for PID.PID. """
+        crossover, margin = RULES[rule]
+        gain, delay = self.process()
+
+        # The PID has to make up the phase margin plus the delay's lag,
+        # and cancel the process gain at the crossover
+        phase = math.radians(margin) + crossover * delay
+        phase = min(phase, math.radians(85.0))
+        tangent = math.tan(phase)
+        # Kp (1 + j (w Td - 1 / (w Ti))) with Ti = INTEGRAL_RATIO Td
+        x = (tangent + math.sqrt(tangent ** 2 + 4.0 / INTEGRAL_RATIO)) / 2.0
+        kp = math.cos(phase) * crossover ** 2 / gain
+        td = x / crossover
+        ti = INTEGRAL_RATIO * td
+        return kp, kp / ti, kp * td
+
+
+class Autotune:
+    def __init__(self, core_module, launcher_app=None):
+        """Class Constructor"""
+        self.killed = False
+        self.core = core_module
+        self.launcher = launcher_app
+        self.ticks = 0
+        self.tick_time = 0.01 # How many seconds per control loop
+        self.time_limit = 30 # Give up after this many seconds
+
+        # Run in simulated time with no sleeping, eg. on wall_plant.PlantCore
+        self.realtime = True
+
+        # As WallFollower's PID mode
+        self.speed_mid = -0.14
+        self.speed_range = -0.2
+        self.distance_midpoint = 200.0
+        self.distance_range = 150.0
+
+        # Stop if the robot strays this far from the wall, or this close
+        self.min_distance = 60.0
+        self.max_distance = 500.0
+
+        # Relay at 30% of full steering, in PID output units
+        self.tuner = RelayTuner(0.3 * self.distance_range, lead=LEAD,
+                                filter_time=INPUT_FILTER)
+        self.rule = 'moderate'
+        self.gains = None
+        self.process = None
+
+    def stop(self):
+        """Simple method to stop the challenge"""
+        self.killed = True
+
+    def run(self):
+        """ Drive along the left wall on the relay until it has measured
+            enough cycles, then work out the gains. """
+        print("Start autotune")
+        self.core.enable_motors(True)
+
+        executor = periodic.PeriodicExecutor(self.tick_time, realtime=self.realtime)
+
+        while (not self.killed and not self.tuner.done() and
+               executor.elapsed() < self.time_limit):
+            distance, rate, valid = self.core.read_filtered(0)
+            if not valid or not (self.min_distance < distance < self.max_distance):
+                print("Lost the wall, stopping")
+                break
+
+            output = self.tuner.update(
+                distance - self.distance_midpoint, executor.elapsed(), rate)
+            deviation = max(-1.0, min(1.0, output / self.distance_range))
+
+            leftspeed = self.speed_mid - (deviation * self.speed_range)
+            rightspeed = self.speed_mid + (deviation * self.speed_range)
+            self.core.throttle(leftspeed, rightspeed)
+
+            self.ticks = self.ticks + 1
+            executor.wait()
+
+        # Leave the core running, for whatever mode comes next
+        self.core.set_neutral()
+
+        if not self.tuner.done():
+            print("Autotune failed after %d cycles" % len(self.tuner.periods))
+            if self.launcher:
+                self.launcher.show_message("Autotune failed")
+            return
+
+        self.process = self.tuner.process()
+        self.gains = self.tuner.gains(self.rule)
+        print("Process gain %f, delay %fs" % self.process)
+        print("Suggested PID gains: %f, %f, %f" % self.gains)
+        if self.launcher:
+            self.launcher.show_autotune_result(self.gains)
+
+
+def simulate(rule='moderate', noise=2.0, seed=0):
+    """ Autotune against the wall_plant model, in simulated time. Returns
+        the Autotune with its results. """
+    import wall_plant
+
+    plant_core = wall_plant.PlantCore(noise=noise, seed=seed)
+    tune = Autotune(plant_core)
+    tune.realtime = False
+    tune.rule = rule
+    plant_core.dt = tune.tick_time
+    tune.run()
+    return tune
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["sim"]:
+        tune = simulate()
+        if tune.gains:
+            import pid_sweep
+            # Settling to within 10mm, a couple of times the lidar noise
+            results = pid_sweep.sweep(*tune.gains, duration=15.0, band=0.1)
+            print("Simulated with these gains from 100mm off: overshoot %.1f%%, "
+                  "settle %.2fs, %d oscillations" % (
+                      results['overshoot'][0], results['settling_time'][0],
+                      results['oscillations'][0]))
+    else:
+        import core
+        import VL53L0X
+        core = core.Core(VL53L0X.tof_lib)
+        tune = Autotune(core)
+        try:
+            tune.run()
+        except (KeyboardInterrupt) as e:
+            # Stop any active threads before leaving
+            tune.stop()
+            core.shutdown()
+            print("Quitting")
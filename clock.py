@@ -0,0 +1,56 @@
+""" The one clock for timing and deadlines: it never jumps backwards.
+
+    Python 3 has time.monotonic. Python 2, which the robot runs, doesn't,
+    and time.time steps whenever NTP corrects the Pi's clock (it has no
+    RTC), so there CLOCK_MONOTONIC is read through ctypes instead. Only
+    off Linux, with no clock_gettime to be found, does it fall back to
+    time.time. """
+import ctypes
+import ctypes.util
+import time
+
+# From <time.h> on Linux
+CLOCK_MONOTONIC = 1
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+def load_clock_gettime():
+    """ Find clock_gettime, in librt on older glibc and libc on newer. """
+    for name in ("rt", "c"):
+        path = ctypes.util.find_library(name)
+        if not path:
+            continue
+        try:
+            library = ctypes.CDLL(path, use_errno=True)
+            clock_gettime = library.clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        return clock_gettime
+    return None
+
+
+def clock_gettime_monotonic():
+    """ Return a monotonic clock function using clock_gettime, or None. """
+    clock_gettime = load_clock_gettime()
+    if clock_gettime is None:
+        return None
+
+    # Filled in on every call rather than allocated each time
+    now = timespec()
+    now_p = ctypes.pointer(now)
+
+    def monotonic():
+        if clock_gettime(CLOCK_MONOTONIC, now_p) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, "clock_gettime failed")
+        return now.tv_sec + now.tv_nsec * 1e-9
+
+    return monotonic
+
+
+monotonic = (getattr(time, 'monotonic', None) or
+             clock_gettime_monotonic() or time.time)
@@ -1,9 +1,18 @@
 from __future__ import division
 import servo_control
+import pwm_output
+import ramp_engine
+import telemetry
 import arduino
 # import sensor
 import i2c_lidar
-from RPIO import PWM
+import lidar_sampler
+import lidar_interrupts
+import lidar_profiles
+import lidar_filter
+import mux_scheduler
+import VL53L0X as VL53L0X_module
+from hardware import PWM, GPIO
 from ctypes import *
 
 LIDAR_PINS = [18, 15, 14]
@@ -11,8 +20,28 @@ LIDAR_LEFT = 0
 LIDAR_FRONT = 1
 LIDAR_RIGHT = 2
 
+# GPIOs wired to each lidar's GPIO1 (data ready) pin, same order as LIDAR_PINS
+LIDAR_INT_PINS = [5, 6, 13]
+
+# Set to a list of TCA9548A channels, one per lidar in the order above,
+# to use lidars behind a multiplexer instead of the XSHUT pins.
+LIDAR_MUX_CHANNELS = None
+LIDAR_MUX_ADDRESS = 0x70
+
 LEFT_SERVO_PIN = 17
 RIGHT_SERVO_PIN = 27
+LEFT_AUX_1_PIN = 22
+RIGHT_AUX_1_PIN = 23
+
+PWM_SET = telemetry.event("pwm_set", "Ramp PWM servos to %d, %d")
+
+# Don't rewrite a servo pulse width for changes this small (microseconds)
+PWM_DEADBAND_US = 2
+
+# Ramp pulse widths this many times a second, changing by at most this
+# many microseconds per second (full throttle in half a second)
+RAMP_RATE_HZ = 200
+RAMP_ACCEL_US = 1200.0
 
 
 class Core():
@@ -60,6 +89,12 @@ class Core():
             self.RIGHT_AUX_1_MID,
             self.RIGHT_AUX_1_MAX, False)
 
+        # Each pair is always set together
+        self.drive_servos = servo_control.ServoGroup(
+            (self.left_servo, self.right_servo))
+        self.aux_1_servos = servo_control.ServoGroup(
+            (self.left_aux_1_servo, self.right_aux_1_servo))
+
         self.left_channel = 1
         self.right_channel = 2
 
@@ -69,19 +104,72 @@ class Core():
 
         # Always set these to None for initialisation
         self.PWMservo = None
+        self.pwm_output = None
+        self.ramp = None
         self.arduino = None
 
         self.arduino_mode = 0  # Not using Arduino
         self.lidars = []
+        self.sampler = None
+        self.dispatcher = None
+        self.profiles = None
+
+        # Read lidars when their data ready line fires rather than
+        # polling them from the sampler thread
+        self.lidar_interrupts = False
 
         if (self.arduino_mode == 1):
             self.arduino = arduino.Arduino()
         else:
             self.arduino = None
             self.PWMservo = PWM.Servo(pulse_incr_us=1)
-            for pin in range(0, 3):
-                i2c_lidar.xshut([LIDAR_PINS[pin]])
-                self.lidars.append(i2c_lidar.create(LIDAR_PINS[pin], tof_lib, 0x2a + pin))
+            self.pwm_output = pwm_output.PWMOutputStage(
+                self.PWMservo, PWM_DEADBAND_US)
+
+            # Ramp speed changes in the background, as the Arduino did
+            self.ramp = ramp_engine.RampEngine(self.pwm_output, RAMP_RATE_HZ)
+            self.ramp.add_channel(LEFT_SERVO_PIN, self.LEFT_MID, RAMP_ACCEL_US)
+            self.ramp.add_channel(RIGHT_SERVO_PIN, self.RIGHT_MID, RAMP_ACCEL_US)
+            self.ramp.add_channel(
+                LEFT_AUX_1_PIN, self.LEFT_AUX_1_MID, RAMP_ACCEL_US)
+            self.ramp.add_channel(
+                RIGHT_AUX_1_PIN, self.RIGHT_AUX_1_MID, RAMP_ACCEL_US)
+            self.ramp.start()
+            scheduler = None
+            if LIDAR_MUX_CHANNELS:
+                self.lidars = i2c_lidar.bring_up_muxed(
+                    LIDAR_MUX_CHANNELS, tof_lib, LIDAR_MUX_ADDRESS)
+                scheduler = mux_scheduler.MuxReadScheduler(self.lidars)
+            else:
+                self.lidars = i2c_lidar.bring_up(LIDAR_PINS, tof_lib, 0x2a)
+
+            # Range all lidars in the background so that reading a
+            # sensor never waits on the I2C bus.
+            self.sampler = lidar_sampler.LidarSampler(
+                self.lidars, VL53L0X_module.read_all,
+                [lidar_filter.LidarFilter() for tof in self.lidars],
+                scheduler=scheduler, read_list=VL53L0X_module.read_list)
+            if self.lidar_interrupts:
+                # Prime the cache, then let data ready edges update it
+                self.sampler.sweep()
+                self.dispatcher = lidar_interrupts.DataReadyDispatcher(
+                    self.lidars, LIDAR_INT_PINS, GPIO)
+                self.dispatcher.subscribe(self.sampler.publish)
+                self.dispatcher.start()
+            else:
+                self.sampler.start()
+                self.sampler.wait_ready(1.0)
+
+            # Adapt each lidar's ranging mode to speed and distance
+            if self.dispatcher:
+                apply_mode = self.dispatcher.set_mode
+            else:
+                apply_mode = self.sampler.request_mode
+            self.profiles = lidar_profiles.RangingProfileManager(
+                len(self.lidars), apply_mode, clock=self.sampler.clock)
+            self.sampler.profiles = self.profiles
+            if self.dispatcher:
+                self.dispatcher.subscribe(self.sampler.update_profiles)
 
     def enable_motors(self, enable):
         """ Called when we want to enable/disable the motors.
@@ -100,18 +188,21 @@ class Core():
             where 0 = neutral """
 
         # Calculate microseconds from command speed
-        left_micros = self.left_servo.micros(left_speed)
-        right_micros = self.right_servo.micros(right_speed)
+        left_micros, right_micros = self.drive_servos.micros_many(
+            (left_speed, right_speed))
+
+        # The sampler retunes the lidars for it on its own thread
+        if self.profiles:
+            self.profiles.set_speed((left_speed + right_speed) / 2.0)
 
         # Tell the Arduino to move to that speed (eventually)
         if self.arduino:
             self.arduino.throttle(left_micros, right_micros)
         else:
-            if self.PWMservo:
-                # TODO: make this ramp speeds using RPIO
-                self.PWMservo.set_servo(LEFT_SERVO_PIN, left_micros)
-                self.PWMservo.set_servo(RIGHT_SERVO_PIN, right_micros)
-                print("Set PWM servos to %d, %d" % (left_micros, right_micros))
+            if self.ramp:
+                self.ramp.set_target(LEFT_SERVO_PIN, left_micros)
+                self.ramp.set_target(RIGHT_SERVO_PIN, right_micros)
+                telemetry.log(PWM_SET, left_micros, right_micros)
 
     def direct_speed(self, left_speed, right_speed):
         """ Send motors speed value in range [-1,1]
@@ -120,36 +211,96 @@ class Core():
             to change speed IMEDIATELY without ramping. """
 
         # Calculate microseconds from command speed
-        left_micros = self.left_servo.micros(left_speed)
-        right_micros = self.right_servo.micros(right_speed)
+        left_micros, right_micros = self.drive_servos.micros_many(
+            (left_speed, right_speed))
 
         # Tell the Arduino to set motors to that speed immediately
         if self.arduino:
             self.arduino.direct_micros(left_micros, right_micros)
         else:
-            if self.PWMservo:
-                self.PWMservo.set_servo(LEFT_SERVO_PIN, left_micros)
-                self.PWMservo.set_servo(RIGHT_SERVO_PIN, right_micros)
+            if self.ramp:
+                self.ramp.set_now(LEFT_SERVO_PIN, left_micros)
+                self.ramp.set_now(RIGHT_SERVO_PIN, right_micros)
+
+    def aux_1_speed(self, left_speed, right_speed):
+        """ Send aux 1 motors speed value in range [-1,1]
+            where 0 = neutral, ramping to it. """
+        left_micros, right_micros = self.aux_1_servos.micros_many(
+            (left_speed, right_speed))
+
+        if self.ramp:
+            self.ramp.set_target(LEFT_AUX_1_PIN, left_micros)
+            self.ramp.set_target(RIGHT_AUX_1_PIN, right_micros)
 
     def set_neutral(self):
         """ Send neutral to the motors IMEDIATELY. """
         if self.arduino:
             self.arduino.direct_micros(self.LEFT_MID, self.RIGHT_MID)
+        elif self.ramp:
+            self.ramp.set_now(LEFT_SERVO_PIN, self.left_servo.micros(0))
+            self.ramp.set_now(RIGHT_SERVO_PIN, self.right_servo.micros(0))
 
-    def read_sensor(self, pin):
-        """ Read a sensor value and return it. """
+    def read_sensor(self, pin, with_age=False):
+        """ Read a sensor value and return it.
+            Lidar values come from the background sampler's cache, so this
+            never blocks. If with_age is set, return (value, age in seconds)
+            instead. """
+        sensor_age = 0.0
         if self.arduino:
             sensor_voltage = self.arduino.read_sensor()
+            sensor_age = self.arduino.sensor_age()
             sensor_value = self.prox.translate(sensor_voltage)
         else:
-            sensor_value = self.lidars[pin].get_distance()
+            sensor_value, sensor_age = self.sampler.latest(pin)
+        if with_age:
+            return sensor_value, sensor_age
         return sensor_value
 
+    def read_filtered(self, pin):
+        """ Return the filtered (distance, rate in mm/s, valid) of a lidar.
+            See lidar_filter.LidarFilter. """
+        return self.sampler.filtered[pin]
+
     def stop(self):
+        """ Put every motor to neutral IMEDIATELY, eg. at the end of a
+            challenge. Everything keeps running, ready for the next one. """
         if self.arduino:
             self.arduino.direct_micros(self.LEFT_MID, self.RIGHT_MID)
-        else:
-            self.PWMservo.set_servo(LEFT_SERVO_PIN, self.LEFT_MID)
-            self.PWMservo.set_servo(RIGHT_SERVO_PIN, self.RIGHT_MID)
-            for pin in range(0,3):
-                i2c_lidar.turnoff(LIDAR_PINS[pin])
+            self.arduino.flush()
+        elif self.ramp:
+            # Always write neutral, however close the last value was
+            self.ramp.set_now(LEFT_SERVO_PIN, self.LEFT_MID, force=True)
+            self.ramp.set_now(RIGHT_SERVO_PIN, self.RIGHT_MID, force=True)
+            if self.ramp.active(LEFT_AUX_1_PIN):
+                self.ramp.set_now(
+                    LEFT_AUX_1_PIN, self.LEFT_AUX_1_MID, force=True)
+            if self.ramp.active(RIGHT_AUX_1_PIN):
+                self.ramp.set_now(
+                    RIGHT_AUX_1_PIN, self.RIGHT_AUX_1_MID, force=True)
+
+    def shutdown(self):
+        """ Put the motors to neutral and stop the background threads,
+            when the program is exiting. Nothing works after this. """
+        self.stop()
+        if self.arduino:
+            self.arduino.stop()
+        if self.ramp:
+            self.ramp.stop()
+        if self.dispatcher:
+            self.dispatcher.stop()
+        if self.sampler:
+            self.sampler.stop()
+        # Stop ranging but leave the lidars powered, so they keep their
+        # addresses and the next bring_up can skip resetting them.
+        for tof in self.lidars:
+            tof.stop_ranging()
+
+        if self.sampler and self.sampler.scheduler:
+            switches, skipped = mux_scheduler.switch_stats()
+            print("mux: %d channel selects sent, %d skipped, %d needed "
+                  "per sweep over %d sweeps" % (
+                      switches, skipped,
+                      self.sampler.scheduler.switches_per_sweep(),
+                      self.sampler.sweeps))
+        if VL53L0X_module.arbiter.stats:
+            print(VL53L0X_module.arbiter.report())
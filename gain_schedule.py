@@ -0,0 +1,126 @@
+""" Wall following controller settings scheduled on forward speed and wall
+    distance, precomputed into dense tables so that each tick costs one
+    lookup and a bilinear interpolation.
+
+    Each control mode is a table generator: a function of (speed,
+    distance) arrays giving every channel below. """
+from __future__ import division
+import numpy as np
+
+# Channels of a table
+DEVIATION = 0    # Open loop steering for the wall distance, [-1, 1]
+PID_SCALE = 1    # Steering per unit of PID output, 0 for no PID
+KP = 2
+KI = 3
+KD = 4
+SPEED_MID = 5    # Speed of both motors with no steering
+SPEED_RANGE = 6  # Speed difference at full steering
+CHANNELS = 7
+
+DISTANCE_MIDPOINT = 200.0  # mm
+
+# Default grid: forward speed (positive forwards) x wall distance (mm)
+SPEEDS = (0.0, 0.5, 11)
+DISTANCES = (0.0, 1000.0, 101)
+
+
+class ScheduleTable():
+    """ Controller settings at each point of an evenly spaced grid of
+        forward speed x wall distance. Lookups outside the grid, eg. a
+        lidar seeing nothing in range, evaluate the generator directly,
+        so they give the same settings as the formula would.
+
+        clip limits the steering to [-1, 1], for the sake of not driving
+        backwards. mirror swaps the motors over when following the right
+        hand wall. """
+
+    def __init__(self, generator, speeds=SPEEDS, distances=DISTANCES,
+                 midpoint=DISTANCE_MIDPOINT, clip=True, mirror=True):
+        """ Constructor. speeds and distances are (first, last, count). """
+        self.generator = generator
+        self.midpoint = midpoint
+        self.clip = clip
+        self.mirror = mirror
+
+        self.speed_first, speed_last, self.speed_count = speeds
+        self.speed_step = (speed_last - self.speed_first) / (self.speed_count - 1)
+        self.distance_first, distance_last, self.distance_count = distances
+        self.distance_step = \
+            (distance_last - self.distance_first) / (self.distance_count - 1)
+
+        speed_grid, distance_grid = np.meshgrid(
+            np.linspace(*speeds), np.linspace(*distances), indexing='ij')
+        channels = generator(speed_grid, distance_grid)
+        self.table = np.empty(speed_grid.shape + (CHANNELS,))
+        for channel, values in enumerate(channels):
+            self.table[:, :, channel] = values
+
+    def lookup(self, speed, distance):
+        """ Interpolated settings at a forward speed and wall distance,
+            indexed by the channel constants. """
+        x = (speed - self.speed_first) / self.speed_step
+        y = (distance - self.distance_first) / self.distance_step
+        if not (0.0 <= x <= self.speed_count - 1 and
+                0.0 <= y <= self.distance_count - 1):
+            return self.evaluate(speed, distance)
+
+        i = min(int(x), self.speed_count - 2)
+        fx = x - i
+        j = min(int(y), self.distance_count - 2)
+        fy = y - j
+
+        table = self.table
+        return ((table[i, j] * (1 - fy) + table[i, j + 1] * fy) * (1 - fx) +
+                (table[i + 1, j] * (1 - fy) + table[i + 1, j + 1] * fy) * fx)
+
+    def evaluate(self, speed, distance):
+        """ Settings straight from the generator, for off the grid. """
+        channels = self.generator(np.float64(speed), np.float64(distance))
+        return np.array([float(value) for value in channels])
+
+
+def gain(value, speed, distance):
+    """ A gain given as a constant or as a function of (speed, distance). """
+    if callable(value):
+        return value(speed, distance)
+    return value
+
+
+def linear_table(**kwargs):
+    """ Steer in proportion to the distance from the midpoint. """
+    def generator(speed, distance):
+        deviation = np.clip((distance - DISTANCE_MIDPOINT) / 100.0, -1, 1)
+        return deviation, 0, 0, 0, 0, -0.2, 0.06
+    return ScheduleTable(generator, **kwargs)
+
+
+def expo_table(**kwargs):
+    """ Steer with the square of the distance from the midpoint. """
+    def generator(speed, distance):
+        deviation = (distance - DISTANCE_MIDPOINT) / 100.0
+        deviation = np.sign(deviation) * deviation * deviation
+        return deviation, 0, 0, 0, 0, 0.05, 0.05
+    return ScheduleTable(generator, clip=False, mirror=False, **kwargs)
+
+
+def pid_table(kp=0.5, ki=0.0, kd=0.1, **kwargs):
+    """ Steer with a PID on the distance from the midpoint. The gains are
+        constants, or functions of (speed, distance) arrays to schedule
+        them. """
+    # straight line, cautious: mid -0.2, range -0.2
+    # maze, cautious: mid -0.1, range -0.2
+    # maze, tuned: mid -0.14, range -0.2
+    def generator(speed, distance):
+        return (0, 1 / 150.0,
+                gain(kp, speed, distance),
+                gain(ki, speed, distance),
+                gain(kd, speed, distance),
+                -0.14, -0.2)
+    return ScheduleTable(generator, **kwargs)
+
+
+TABLES = {
+    "LINEAR": linear_table,
+    "EXPO": expo_table,
+    "PID": pid_table,
+}
@@ -0,0 +1,71 @@
+""" Single place that imports the Pi's hardware libraries.
+
+    Everything else imports PWM, RPIO, GPIO, SMBus, cwiid and the lidar
+    library from here, so that the whole stack can be switched to the
+    in-process fakes in sim_hardware.py and run off the robot.
+
+    The backend is "pi" unless the PIWARS_BACKEND environment variable
+    says otherwise, or failing that the backend setting in the [hardware]
+    section of hardware.ini. Set it to "sim" for the fakes. """
+import os
+
+try:
+    from ConfigParser import SafeConfigParser as ConfigParser
+except ImportError:
+    from configparser import ConfigParser
+
+CONFIG_FILE = "hardware.ini"
+
+
+def read_backend():
+    """ Work out which backend to use. """
+    backend = os.environ.get("PIWARS_BACKEND")
+    if backend:
+        return backend
+
+    if os.path.isfile(CONFIG_FILE):
+        config = ConfigParser()
+        config.read(CONFIG_FILE)
+        if config.has_option("hardware", "backend"):
+            return config.get("hardware", "backend")
+
+    return "pi"
+
+
+BACKEND = read_backend()
+
+if BACKEND == "sim":
+    import sim_hardware
+
+    PWM = sim_hardware.SimPWM
+    RPIO = sim_hardware.rpio
+    GPIO = sim_hardware.gpio
+    cwiid = sim_hardware.cwiid
+
+    # No combined transactions on the fake bus
+    i2c_msg = None
+
+    def SMBus(bus):
+        return sim_hardware.i2c_bus
+
+    def load_tof_lib(path):
+        return sim_hardware.tof_lib
+
+elif BACKEND == "pi":
+    import RPIO
+    from RPIO import PWM
+    import RPi.GPIO as GPIO
+    import cwiid
+    from ctypes import CDLL as load_tof_lib
+
+    # smbus2 can do combined I2C transactions (i2c_rdwr), plain smbus
+    # can't. Prefer it, but keep working with the Raspbian python-smbus
+    # package.
+    try:
+        from smbus2 import SMBus, i2c_msg
+    except ImportError:
+        from smbus import SMBus
+        i2c_msg = None
+
+else:
+    raise ValueError("Unknown hardware backend %s" % BACKEND)
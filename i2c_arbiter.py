@@ -0,0 +1,147 @@
+import os
+import threading
+
+from clock import monotonic
+
+# Client priorities, lower goes first
+PRIORITY_SENSOR = 0
+PRIORITY_DISPLAY = 10
+
+# Transactions a waiting client can be passed over for by higher priority
+# clients before it goes next anyway
+MAX_PASSED = 8
+
+# Record per client bus utilisation, eg. PIWARS_I2C_STATS=1
+STATS = os.environ.get("PIWARS_I2C_STATS", "0") not in ("", "0")
+
+
+class BusArbiter():
+    """ Serialise transactions on an I2C bus shared between threads, eg.
+        the lidar callbacks and the OLED display.
+
+        Each user of the bus gets its own client(), which looks like the
+        bus object itself. Every method call on a client is one
+        transaction: it waits until the bus is free and no higher priority
+        client is waiting, then runs with the bus to itself. So that a
+        busy sensor can't starve the display, a client that has been passed
+        over MAX_PASSED times goes next regardless of priority.
+
+        A long transfer made of several calls, like a full display()
+        refresh, gives the bus up between calls, so a sensor read only
+        ever waits for one chunk rather than the whole transfer.
+
+        Timing each transaction costs a couple of clock reads on the lidar
+        path, so utilisation() is only recorded with stats set, by
+        default from PIWARS_I2C_STATS in the environment. """
+
+    def __init__(self, bus, stats=STATS):
+        """ Constructor """
+        self.bus = bus
+        self.stats = stats
+        self.condition = threading.Condition()
+        self.busy = False
+        # [priority, times passed over] per waiting transaction
+        self.waiting = []
+        self.clients = []
+        self.started = monotonic()
+
+    def client(self, name, priority):
+        """ Make a new bus client. """
+        client = BusClient(self, name, priority)
+        self.clients.append(client)
+        return client
+
+    def next_waiter(self):
+        for waiter in self.waiting:
+            if waiter[1] >= MAX_PASSED:
+                return waiter
+        return min(self.waiting, key=lambda waiter: waiter[0])
+
+    def acquire(self, priority):
+        with self.condition:
+            waiter = [priority, 0]
+            self.waiting.append(waiter)
+            while self.busy or self.next_waiter() is not waiter:
+                self.condition.wait()
+            self.waiting.remove(waiter)
+            for other in self.waiting:
+                other[1] += 1
+            self.busy = True
+
+    def release(self):
+        with self.condition:
+            self.busy = False
+            if self.waiting:
+                self.condition.notify_all()
+
+    def utilisation(self):
+        """ Return {client name: (transactions, seconds waiting,
+            seconds on the bus, fraction of time on the bus)}, all zero
+            unless stats is set. """
+        elapsed = max(monotonic() - self.started, 1e-9)
+        return dict((client.name, (client.transactions,
+                                   client.wait_time,
+                                   client.bus_time,
+                                   client.bus_time / elapsed))
+                    for client in self.clients)
+
+    def report(self):
+        """ utilisation() as a line per client, for printing. """
+        return "\n".join(
+            "i2c %s: %d transactions, %.3fs waiting, %.3fs on the bus (%.1f%%)"
+            % (name, transactions, wait_time, bus_time, fraction * 100)
+            for name, (transactions, wait_time, bus_time, fraction)
+            in sorted(self.utilisation().items()))
+
+    def reset_stats(self):
+        self.started = monotonic()
+        for client in self.clients:
+            client.transactions = 0
+            client.wait_time = 0.0
+            client.bus_time = 0.0
+
+
+class BusClient():
+    """ One user's view of a BusArbiter's bus. Has the same methods as
+        the bus, with each call run as a single arbitrated transaction.
+        The methods are wrapped once here rather than on every call. """
+
+    def __init__(self, arbiter, name, priority):
+        """ Constructor """
+        self.arbiter = arbiter
+        self.name = name
+        self.priority = priority
+        self.transactions = 0
+        self.wait_time = 0.0
+        self.bus_time = 0.0
+
+        for attr in dir(arbiter.bus):
+            if attr.startswith('_') or hasattr(self, attr):
+                continue
+            method = getattr(arbiter.bus, attr)
+            if callable(method):
+                setattr(self, attr, self.transaction(method))
+
+    def transaction(self, method):
+        arbiter = self.arbiter
+        priority = self.priority
+
+        def transaction(*args, **kwargs):
+            if not arbiter.stats:
+                arbiter.acquire(priority)
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    arbiter.release()
+
+            requested = monotonic()
+            arbiter.acquire(priority)
+            granted = monotonic()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                arbiter.release()
+                self.transactions += 1
+                self.wait_time += granted - requested
+                self.bus_time += monotonic() - granted
+        return transaction
@@ -3,7 +3,18 @@
 import time
 #from VL53L0X import VL53L0X
 import VL53L0X as VL53L0X_module
-import RPIO
+from hardware import RPIO
+
+# VL53L0X power-on address
+DEFAULT_ADDRESS = 0x29
+
+# How long XSHUT must be held to reset a sensor. The datasheet only asks
+# for 100us, so this is generous.
+RESET_TIME = 0.01
+
+# Give up waiting for a sensor to boot after this long. tBOOT is 1.2ms max.
+BOOT_TIMEOUT = 0.1
+BOOT_POLL = 0.001
 
 
 def xshut(gpios):
@@ -39,3 +50,76 @@ def create(gpio, tof_lib, addr):
 
 def turnoff(gpio):
     RPIO.output(gpio, 1)
+
+
+def wait_for_boot(addr=DEFAULT_ADDRESS, timeout=BOOT_TIMEOUT, **mux):
+    """ Poll a device until it answers, rather than sleeping for a guessed
+        wake time. mux is TCA9548A_Num and TCA9548A_Addr for a device
+        behind a multiplexer. Returns the seconds it took, or None on
+        timeout. """
+    start = time.time()
+    while True:
+        elapsed = time.time() - start
+        if VL53L0X_module.probe(addr, **mux):
+            return elapsed
+        if elapsed > timeout:
+            return None
+        time.sleep(BOOT_POLL)
+
+
+def bring_up(gpios, tof_lib, base_addr=0x2a):
+    """ Turn on and start a set of devices as quickly as possible. Device n
+        (by position in gpios) ends up at address base_addr + n.
+
+        Devices keep their address until reset, so any that already answer
+        at their address are left alone. The rest are all reset together,
+        then woken one at a time and readdressed as soon as each answers
+        at the default address. Returns the list of VL53L0X objects. """
+    start = time.time()
+    addresses = [base_addr + index for index in range(len(gpios))]
+    configured = [VL53L0X_module.probe(addr) for addr in addresses]
+
+    # One shared reset for every device that needs addressing
+    if not all(configured):
+        for gpio, done in zip(gpios, configured):
+            # PNP transistors so GPIO 1 = sensor power off
+            RPIO.setup(gpio, RPIO.OUT, initial=0 if done else 1)
+        time.sleep(RESET_TIME)
+
+    tofs = []
+    for gpio, addr, done in zip(gpios, addresses, configured):
+        if done:
+            print("lidar already at 0x%02x" % addr)
+        else:
+            RPIO.output(gpio, 0)   # Set the pin low, sensor on
+            boot_time = wait_for_boot()
+            if boot_time is None:
+                print("lidar on GPIO %d did not wake" % gpio)
+            else:
+                print("lidar on GPIO %d woke in %.1f ms" % (gpio, boot_time * 1000))
+
+        tof = VL53L0X_module.VL53L0X(tof_lib=tof_lib, address=addr)
+        tof.start_ranging(VL53L0X_module.VL53L0X_LONG_RANGE_MODE)
+        tofs.append(tof)
+
+    print("lidars enabled in %.0f ms" % ((time.time() - start) * 1000))
+    return tofs
+
+
+def bring_up_muxed(channels, tof_lib, mux_addr=0x70, addr=DEFAULT_ADDRESS):
+    """ Start a set of devices that sit behind a TCA9548A multiplexer, one
+        per channel, all at addr. Devices on different channels can share
+        an address, so no XSHUT juggling or readdressing is needed. Returns
+        the list of VL53L0X objects, in the order of channels. """
+    tofs = []
+    for channel in channels:
+        if wait_for_boot(addr, TCA9548A_Num=channel,
+                         TCA9548A_Addr=mux_addr) is None:
+            print("no lidar answering on mux channel %d" % channel)
+        tof = VL53L0X_module.VL53L0X(
+            tof_lib=tof_lib, address=addr,
+            TCA9548A_Num=channel, TCA9548A_Addr=mux_addr)
+        tof.start_ranging(VL53L0X_module.VL53L0X_LONG_RANGE_MODE)
+        tofs.append(tof)
+    print("%d muxed lidars enabled" % len(tofs))
+    return tofs
@@ -1,19 +1,19 @@
 #!/usr/bin/env python
 import sys
-import cwiid
 import logging
 import time
 import threading
 from wiimote import Wiimote, WiimoteException
-import RPi.GPIO as GPIO
+from hardware import GPIO, cwiid
 
 import core
 import rc
 import Calibration
+import autotune
 from lib_oled96 import ssd1306
 
 import VL53L0X
-from smbus import SMBus
+import i2c_arbiter
 
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
@@ -45,11 +45,14 @@ class launcher:
         self.MODE_WALL = 3
         self.MODE_MAZE = 4
         self.MODE_CALIBRATION = 5
+        self.MODE_AUTOTUNE = 6
 
         self.mode = self.MODE_NONE
 
-        # create oled object, nominating the correct I2C bus, default address
-        self.oled = ssd1306(VL53L0X.i2cbus)
+        # create oled object, nominating the correct I2C bus, default address.
+        # The bus is shared with the lidars, which get priority over it.
+        self.oled = ssd1306(VL53L0X.arbiter.client(
+            "oled", i2c_arbiter.PRIORITY_DISPLAY))
 
     def stop_threads(self):
         """ Single point of call to stop any RC or Challenge Threads """
@@ -98,6 +101,8 @@ class launcher:
             self.oled.canvas.text((10, 10), 'Mode: Maze', fill=1)
         elif self.mode == self.MODE_CALIBRATION:
             self.oled.canvas.text((10, 10), 'Mode: Calibration', fill=1)
+        elif self.mode == self.MODE_AUTOTUNE:
+            self.oled.canvas.text((10, 10), 'Mode: Autotune', fill=1)
         # Now show the mesasge on the screen
         self.oled.display()
 
@@ -139,6 +144,16 @@ class launcher:
         # Now show the mesasge on the screen
         self.oled.display()
 
+    def show_autotune_result(self, gains):
+        """ Show the PID gains autotune came up with on OLED display """
+        message = "%.2f/%.2f/%.2f" % gains
+
+        self.oled.cls()  # Clear Screen
+        self.oled.canvas.text((10, 10), "PID gains:", fill=1)
+        self.oled.canvas.text((10, 30), message, fill=1)
+        # Now show the mesasge on the screen
+        self.oled.display()
+
     def read_config(self):
         # Read the config file when starting up.
         if self.reading_calibration:
@@ -194,6 +209,30 @@ class launcher:
         # Show state on OLED display
         self.show_mode()
 
+    def start_autotune_mode(self):
+        # Kill any previous Challenge / RC mode
+        self.stop_threads()
+
+        # Set Wiimote LED to Autotune Mode index
+        self.mode = self.MODE_AUTOTUNE
+        if self.wiimote and self.wiimote.wm:
+            self.wiimote.wm.led = self.mode
+
+        # Inform user we are about to start autotune mode
+        logging.info("Entering into Autotune Mode")
+        self.challenge = autotune.Autotune(self.core, self)
+
+        # Create and start a new thread
+        # running the autotune script
+        logging.info("Starting Autotune Thread")
+        self.challenge_thread = threading.Thread(
+            target=self.challenge.run)
+        self.challenge_thread.start()
+        logging.info("Autotune Thread Running")
+
+        # Show state on OLED display
+        self.show_mode()
+
     def run(self):
         """ Main Running loop controling bot mode and menu state """
         # Show state on OLED display
@@ -239,6 +278,9 @@ class launcher:
                     if (buttons_state & cwiid.BTN_HOME):
                         self.start_calibration_mode()
 
+                    if (buttons_state & cwiid.BTN_PLUS):
+                        self.start_autotune_mode()
+
                     if (buttons_state & cwiid.BTN_B):
                         # Kill any previous Challenge / RC mode
                         self.stop_threads()
@@ -283,6 +325,7 @@ if __name__ == "__main__":
         # Stop any active threads before leaving
         launcher.wiimote = None
         launcher.stop_threads()  # This will set neutral for us.
+        launcher.core.shutdown()
         print("Stopping")
         print(str(e))
         # Show state on OLED display
@@ -0,0 +1,119 @@
+import numpy
+
+# VL53L0X reports this (or more) when nothing is in range
+OUT_OF_RANGE = 8190
+
+
+class LidarFilter():
+    """ Clean up the readings of one lidar.
+
+        Each sample goes through three stages:
+        - sentinel rejection: error values (-1, 0), out of range values
+          and samples with a non-zero range status are dropped.
+        - median of the last window_size accepted samples, to knock out
+          single sample spikes.
+        - a constant velocity Kalman filter over the median, giving a
+          smoothed distance and a distance rate in mm/s.
+
+        The sample window is a fixed size NumPy ring buffer and the median
+        is taken with an in-place sort of a preallocated copy, so nothing
+        is allocated per sample.
+
+        The output is only flagged valid if a sample was accepted within
+        the last max_gap seconds. """
+
+    def __init__(self, window_size=5, accel_noise=5000.0,
+                 measurement_noise=100.0, max_gap=0.3):
+        """ Constructor """
+        self.window = numpy.zeros(window_size)
+        self.sorted = numpy.zeros(window_size)
+        self.window_size = window_size
+        self.head = 0
+        self.count = 0
+
+        # Process noise (mm/s^2)^2 and measurement noise mm^2
+        self.accel_noise = accel_noise
+        self.measurement_noise = measurement_noise
+        self.max_gap = max_gap
+
+        self.reset()
+
+    def reset(self):
+        """ Forget all previous samples. """
+        self.head = 0
+        self.count = 0
+
+        # Kalman state and covariance [[p00, p01], [p01, p11]]
+        self.distance = 0.0
+        self.rate = 0.0
+        self.p00 = 0.0
+        self.p01 = 0.0
+        self.p11 = 0.0
+
+        self.last_time = None
+        self.last_accepted = None
+        self.valid = False
+        self.rejected = 0
+
+    def is_sentinel(self, distance, status):
+        return status != 0 or distance <= 0 or distance >= OUT_OF_RANGE
+
+    def median(self, distance):
+        """ Add a sample to the ring buffer and return the window median. """
+        self.window[self.head] = distance
+        self.head = (self.head + 1) % self.window_size
+        if self.count < self.window_size:
+            self.count += 1
+
+        numpy.copyto(self.sorted, self.window)
+        if self.count < self.window_size:
+            # Pad the unused slots past every real sample before sorting
+            self.sorted[self.count:] = numpy.inf
+        self.sorted.sort()
+        return float(self.sorted[(self.count - 1) // 2])
+
+    def predict(self, dt):
+        """ Move the Kalman state on by dt seconds. """
+        self.distance += self.rate * dt
+        dt2 = dt * dt
+        q = self.accel_noise
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt2 * dt2 / 4
+        self.p01 += dt * self.p11 + q * dt2 * dt / 2
+        self.p11 += q * dt2
+
+    def correct(self, measurement):
+        """ Fold a measurement into the Kalman state. """
+        s = self.p00 + self.measurement_noise
+        k0 = self.p00 / s
+        k1 = self.p01 / s
+        innovation = measurement - self.distance
+        self.distance += k0 * innovation
+        self.rate += k1 * innovation
+        self.p11 -= k1 * self.p01
+        self.p01 -= k0 * self.p01
+        self.p00 -= k0 * self.p00
+
+    def update(self, distance, status, timestamp):
+        """ Filter a new sample. Returns (distance, rate, valid). """
+        if self.last_time is not None:
+            self.predict(timestamp - self.last_time)
+        self.last_time = timestamp
+
+        if self.is_sentinel(distance, status):
+            self.rejected += 1
+        else:
+            measurement = self.median(distance)
+            if self.last_accepted is None:
+                # First sample: start at rest with the sample's variance
+                self.distance = measurement
+                self.rate = 0.0
+                self.p00 = self.measurement_noise
+                self.p01 = 0.0
+                self.p11 = self.accel_noise
+            else:
+                self.correct(measurement)
+            self.last_accepted = timestamp
+
+        self.valid = self.last_accepted is not None and \
+            timestamp - self.last_accepted <= self.max_gap
+        return self.distance, self.rate, self.valid
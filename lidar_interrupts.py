@@ -0,0 +1,64 @@
+import threading
+
+
+class DataReadyDispatcher():
+    """ Event driven ranging for VL53L0X sensors.
+
+        The ST API leaves each sensor's GPIO1 pin configured as an active
+        low "new sample ready" interrupt. Wire those to Pi GPIOs and this
+        class reads a sensor only when it has fresh data, then passes the
+        sample to every subscriber as callback(index, distance).
+
+        gpio is the RPi.GPIO module, or sim_hardware.SimGPIO off the Pi. """
+
+    def __init__(self, lidars, int_pins, gpio):
+        """ Constructor """
+        self.lidars = lidars
+        self.int_pins = int_pins
+        self.gpio = gpio
+        self.subscribers = []
+        self.samples = [0] * len(lidars)
+
+        # Map GPIO channel back to sensor index for the edge callback
+        self.pin_index = dict((pin, index) for index, pin in enumerate(int_pins))
+
+        # RPi.GPIO runs edge callbacks on its own thread
+        self.lock = threading.Lock()
+
+    def subscribe(self, callback):
+        """ Call callback(index, distance) for every new sample. """
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def set_mode(self, index, mode):
+        """ Change a sensor's ranging mode, without racing a read of it. """
+        with self.lock:
+            self.lidars[index].set_mode(mode)
+
+    def start(self):
+        """ Start listening for data-ready edges. """
+        self.gpio.setmode(self.gpio.BCM)
+        for pin in self.int_pins:
+            # GPIO1 is open drain, pull it up ourselves in case the
+            # breakout board doesn't.
+            self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+            self.gpio.add_event_detect(
+                pin, self.gpio.FALLING, callback=self.on_edge)
+
+    def stop(self):
+        """ Stop listening for data-ready edges. """
+        for pin in self.int_pins:
+            self.gpio.remove_event_detect(pin)
+
+    def on_edge(self, channel):
+        """ GPIO edge callback. The sample is already waiting so
+            get_distance returns straight away, and reading it clears
+            the sensor's interrupt ready for the next one. """
+        index = self.pin_index[channel]
+        with self.lock:
+            distance = self.lidars[index].get_distance()
+            self.samples[index] += 1
+        for callback in self.subscribers:
+            callback(index, distance)
@@ -0,0 +1,87 @@
+import VL53L0X as VL53L0X_module
+from clock import monotonic
+from lidar_filter import OUT_OF_RANGE
+
+
+class RangingProfileManager():
+    """ Pick a ranging mode for each lidar from how fast we're driving and
+        what it can see.
+
+        - Beyond far_mm (or nothing in range) only LONG_RANGE can see
+          anything, eg. the front sensor approaching a corner.
+        - Inside near_mm, or whenever we're driving at fast_speed or more,
+          fresh samples matter more than accuracy so use HIGH_SPEED.
+        - Otherwise use GOOD_ACCURACY.
+
+        Switching stops and restarts the sensor, so a sensor keeps its
+        mode for at least hold_time seconds by clock, and the distance
+        bands have hysteresis_mm of slack either side.
+
+        The control loop only notes its speed with set_speed(). update()
+        runs on whichever thread owns the sensors, eg. between the
+        sampler's sweeps, and calls apply(index, mode) to actually change
+        a sensor's mode. """
+
+    def __init__(self, count, apply, initial_mode=VL53L0X_module.VL53L0X_LONG_RANGE_MODE,
+                 near_mm=300, far_mm=1000, fast_speed=0.3,
+                 hysteresis_mm=50, hold_time=0.5, clock=monotonic):
+        """ Constructor """
+        self.apply = apply
+        self.near_mm = near_mm
+        self.far_mm = far_mm
+        self.fast_speed = fast_speed
+        self.hysteresis_mm = hysteresis_mm
+        self.hold_time = hold_time
+        self.clock = clock
+
+        # Latest commanded forward speed, from the control loop
+        self.speed = 0.0
+
+        self.modes = [initial_mode] * count
+        self.last_switch = [float('-inf')] * count
+        self.switches = 0
+
+    def set_speed(self, speed):
+        """ Note the commanded forward speed in [-1, 1], for the next
+            update(). """
+        self.speed = speed
+
+    def choose(self, index, speed, distance):
+        """ Decide which mode a sensor should be in. """
+        current = self.modes[index]
+
+        # Widen whichever band we're already in, so that we don't flip
+        # back and forth on a reading sitting right on a threshold.
+        far_mm = self.far_mm
+        near_mm = self.near_mm
+        if current == VL53L0X_module.VL53L0X_LONG_RANGE_MODE:
+            far_mm -= self.hysteresis_mm
+        if current == VL53L0X_module.VL53L0X_HIGH_SPEED_MODE:
+            near_mm += self.hysteresis_mm
+
+        if distance < 0 or distance >= OUT_OF_RANGE or distance > far_mm:
+            return VL53L0X_module.VL53L0X_LONG_RANGE_MODE
+        if distance < near_mm or abs(speed) >= self.fast_speed:
+            return VL53L0X_module.VL53L0X_HIGH_SPEED_MODE
+        return VL53L0X_module.VL53L0X_GOOD_ACCURACY_MODE
+
+    def update(self, distances, speed=None, now=None):
+        """ Re-evaluate every sensor given the latest distance of each
+            sensor and the commanded forward speed, by default the last
+            one given to set_speed(). """
+        if speed is None:
+            speed = self.speed
+        if now is None:
+            now = self.clock()
+        for index, distance in enumerate(distances):
+            mode = self.choose(index, speed, distance)
+            if mode != self.modes[index] and \
+                    now - self.last_switch[index] >= self.hold_time:
+                self.modes[index] = mode
+                self.last_switch[index] = now
+                self.switches += 1
+                self.apply(index, mode)
+
+    def timing(self, index):
+        """ Expected microseconds per measurement of a sensor. """
+        return VL53L0X_module.mode_timing(self.modes[index])
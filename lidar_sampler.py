@@ -0,0 +1,138 @@
+import threading
+
+from clock import monotonic
+
+
+class LidarSampler():
+    """ Continuously range a set of VL53L0X sensors in a background thread
+        and keep the latest reading of each one.
+
+        Each slot in self.readings holds a (distance, status, timestamp)
+        tuple. Slots are replaced wholesale rather than modified, so readers
+        always see a consistent set of values without taking a lock.
+
+        If read_all is given (see VL53L0X.read_all) all sensors are read
+        with one call per sweep, otherwise each is read in turn.
+
+        If a scheduler (mux_scheduler.MuxReadScheduler) and read_list (see
+        VL53L0X.read_list) are given instead, sensors are read with one
+        call per sweep in the order the scheduler picks.
+
+        If filters are given (one lidar_filter.LidarFilter per sensor) each
+        new reading is also run through its sensor's filter, and the
+        (distance, rate, valid) result kept in self.filtered.
+
+        If profiles is set (lidar_profiles.RangingProfileManager) it is
+        updated at the start of each sweep, so any mode switches happen on
+        this thread rather than the caller's. """
+
+    def __init__(self, lidars, read_all=None, filters=None, clock=monotonic,
+                 scheduler=None, read_list=None):
+        """ Constructor """
+        self.lidars = lidars
+        self.read_all = read_all
+        self.scheduler = scheduler
+        self.read_list = read_list
+        self.filters = filters
+        self.clock = clock
+        self.killed = False
+        self.thread = None
+        self.sweeps = 0
+
+        # Nothing read yet: distance -1, never stamped.
+        self.readings = [(-1, 0, None)] * len(lidars)
+        self.filtered = [(-1, 0.0, False)] * len(lidars)
+        self.ready = threading.Event()
+
+        # Ranging mode changes waiting to be applied between sweeps, and
+        # the timing budget (us) each sensor reported after its last change
+        self.pending_modes = {}
+        self.timings = [0] * len(lidars)
+        self.profiles = None
+
+    def start(self):
+        """ Start the acquisition thread. """
+        self.killed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the acquisition thread and wait for it to finish
+            its current sweep. """
+        self.killed = True
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def wait_ready(self, timeout=None):
+        """ Block until every sensor has been read at least once. """
+        return self.ready.wait(timeout)
+
+    def publish(self, index, distance, status=0, timestamp=None):
+        """ Store a new reading for a sensor. """
+        if timestamp is None:
+            timestamp = self.clock()
+        self.readings[index] = (distance, status, timestamp)
+        if self.filters:
+            self.filtered[index] = \
+                self.filters[index].update(distance, status, timestamp)
+
+    def request_mode(self, index, mode):
+        """ Ask for a sensor's ranging mode to be changed. The sensors are
+            only touched from the sampler thread, so this takes effect at
+            the start of the next sweep. """
+        self.pending_modes[index] = mode
+
+    def update_profiles(self, *args):
+        """ Let the profile manager pick modes for the latest readings.
+            Takes and ignores a dispatcher subscriber's arguments, for
+            interrupt driven ranging where there are no sweeps. """
+        if self.profiles:
+            self.profiles.update([reading[0] for reading in self.readings])
+
+    def apply_modes(self):
+        """ Apply any requested ranging mode changes. """
+        while self.pending_modes:
+            index, mode = self.pending_modes.popitem()
+            tof = self.lidars[index]
+            if tof.set_mode(mode):
+                self.timings[index] = tof.get_timing()
+
+    def sweep(self):
+        """ Read every sensor once and publish the results. """
+        self.update_profiles()
+        self.apply_modes()
+        if self.scheduler:
+            order = self.scheduler.next_order()
+            readings = self.read_list(self.scheduler.object_numbers(order))
+            timestamp = self.clock()
+            for index, (distance, status) in zip(order, readings):
+                self.publish(index, distance, status, timestamp)
+        elif self.read_all:
+            # One snapshot of every sensor, indexed by object number
+            readings = self.read_all()
+            timestamp = self.clock()
+            for index, tof in enumerate(self.lidars):
+                distance, status = readings[tof.my_object_number]
+                self.publish(index, distance, status, timestamp)
+        else:
+            for index, tof in enumerate(self.lidars):
+                self.publish(index, tof.get_distance())
+        self.sweeps += 1
+        self.ready.set()
+
+    def run(self):
+        """ Thread body, sweep until told to stop. get_distance blocks
+            until the sensor has a new sample, so this paces itself to
+            the sensors' timing budget. """
+        while not self.killed:
+            self.sweep()
+
+    def latest(self, index):
+        """ Return the most recent (distance, age in seconds) for a sensor.
+            Age is infinite if the sensor has never been read. """
+        distance, status, timestamp = self.readings[index]
+        if timestamp is None:
+            return distance, float('inf')
+        return distance, self.clock() - timestamp
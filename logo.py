@@ -65,5 +65,5 @@ if __name__ == "__main__":
         # except (Exception, KeyboardInterrupt) as e:
         # Stop any active threads before leaving
         logo.stop()
-        core.stop()
+        core.shutdown()
         print("Quitting")        
@@ -0,0 +1,55 @@
+import itertools
+
+import VL53L0X as VL53L0X_module
+
+
+class MuxReadScheduler():
+    """ Order lidar reads so that a sweep switches TCA9548A channels as
+        few times as possible.
+
+        Sensors are grouped by (mux address, channel), so each channel is
+        selected once per sweep however many sensors sit on it. Sensors
+        not behind a mux don't need a channel and are read first. The
+        channel groups are walked in alternate directions on alternate
+        sweeps, so the channel selected at the end of one sweep is still
+        selected for the start of the next.
+
+        VL53L0X.i2c_write skips selecting the channel that's already
+        selected, which is what turns this ordering into fewer bus
+        transactions. """
+
+    def __init__(self, lidars):
+        """ Constructor """
+        self.lidars = lidars
+
+        direct = []
+        groups = {}
+        for index, tof in enumerate(lidars):
+            if tof.TCA9548A_Device < 8:
+                key = (tof.TCA9548A_Address, tof.TCA9548A_Device)
+                groups.setdefault(key, []).append(index)
+            else:
+                direct.append(index)
+
+        self.direct = direct
+        self.groups = [groups[key] for key in sorted(groups)]
+        self.forward = True
+
+    def next_order(self):
+        """ Sensor indices in the order to read them this sweep. """
+        groups = self.groups if self.forward else self.groups[::-1]
+        self.forward = not self.forward
+        return self.direct + list(itertools.chain.from_iterable(groups))
+
+    def switches_per_sweep(self):
+        """ Channel selects needed per sweep once running. """
+        return max(len(self.groups) - 1, 0)
+
+    def object_numbers(self, order):
+        """ Library object numbers for a list of sensor indices. """
+        return [self.lidars[index].my_object_number for index in order]
+
+
+def switch_stats():
+    """ Return (channel selects sent, channel selects skipped) so far. """
+    return VL53L0X_module.mux_switches, VL53L0X_module.mux_skipped
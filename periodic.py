@@ -0,0 +1,129 @@
+import math
+import time
+
+from clock import monotonic
+
+
+class PeriodicExecutor():
+    """ Pace a control loop at a fixed rate.
+
+        Ticks are scheduled against absolute deadlines (start + n * period)
+        rather than sleeping a fixed time after each tick's work, so the
+        rate doesn't drift with how long the work takes.
+
+        A tick whose work runs past its deadline is an overrun. The next
+        tick starts straight away, and any deadlines missed entirely are
+        skipped rather than run back to back to catch up.
+
+        With realtime off nothing sleeps and time is simulated, advancing
+        exactly one period per tick, eg. for replays and simulations.
+
+        Usage:
+            executor.start()
+            while executor.elapsed() < time_limit:
+                ... do the tick's work ...
+                executor.wait() """
+
+    def __init__(self, period, realtime=True, clock=monotonic, sleep=time.sleep):
+        """ Constructor """
+        self.period = period
+        self.realtime = realtime
+        self.clock = clock
+        self.sleep = sleep
+        self.sim_time = 0.0
+        self.start()
+
+    def now(self):
+        if self.realtime:
+            return self.clock()
+        return self.sim_time
+
+    def start(self):
+        """ (Re)start the schedule from now, and clear the statistics. """
+        self.start_time = self.now()
+        self.last_tick = self.start_time
+
+        # Number of the next deadline, counting from start_time
+        self.deadline_number = 1
+        self.deadline = self.start_time + self.period
+
+        self.ticks = 0
+        self.overruns = 0
+        self.skipped = 0
+
+        # Running mean and variance of the actual period (Welford)
+        self.period_mean = 0.0
+        self.period_m2 = 0.0
+        self.period_min = float('inf')
+        self.period_max = 0.0
+
+        # How late each tick started relative to its deadline
+        self.lateness_total = 0.0
+        self.lateness_max = 0.0
+
+    def elapsed(self):
+        """ Seconds since start(). """
+        return self.now() - self.start_time
+
+    def wait(self):
+        """ Finish a tick: sleep until the next deadline. """
+        if self.realtime:
+            remaining = self.deadline - self.clock()
+            if remaining > 0:
+                # Never more than a period, whatever the clock says
+                self.sleep(min(remaining, self.period))
+            else:
+                self.overruns += 1
+        else:
+            self.sim_time = self.deadline
+
+        now = self.now()
+        self.record(now)
+
+        # Schedule the next tick, dropping any deadlines already missed.
+        # Work each deadline out from the start rather than adding up
+        # periods, so rounding errors don't build up.
+        self.deadline_number += 1
+        due = int((now - self.start_time) / self.period) + 1
+        if due > self.deadline_number:
+            self.skipped += due - self.deadline_number
+            self.deadline_number = due
+        self.deadline = self.start_time + self.deadline_number * self.period
+
+    def record(self, now):
+        """ Update the statistics for a tick starting at now. """
+        period = now - self.last_tick
+        self.last_tick = now
+        self.ticks += 1
+
+        delta = period - self.period_mean
+        self.period_mean += delta / self.ticks
+        self.period_m2 += delta * (period - self.period_mean)
+        self.period_min = min(self.period_min, period)
+        self.period_max = max(self.period_max, period)
+
+        lateness = max(now - self.deadline, 0.0)
+        self.lateness_total += lateness
+        self.lateness_max = max(self.lateness_max, lateness)
+
+    def stats(self):
+        """ Return a dict of timing statistics since start(). """
+        ticks = max(self.ticks, 1)
+        return dict(
+            ticks=self.ticks,
+            overruns=self.overruns,
+            skipped=self.skipped,
+            period_mean=self.period_mean,
+            period_min=self.period_min if self.ticks else 0.0,
+            period_max=self.period_max,
+            period_jitter=math.sqrt(self.period_m2 / ticks),
+            lateness_mean=self.lateness_total / ticks,
+            lateness_max=self.lateness_max)
+
+    def summary(self):
+        """ One line description of the statistics. """
+        return ("%(ticks)d ticks, %(overruns)d overruns, %(skipped)d skipped, "
+                "period %(period_mean).4fs (%(period_min).4f-%(period_max).4f, "
+                "jitter %(period_jitter).4f), "
+                "late %(lateness_mean).4fs mean %(lateness_max).4fs max"
+                % self.stats())
@@ -0,0 +1,179 @@
+""" Evaluate thousands of PID gain combinations at once against the wall
+    following model in wall_plant.py, to narrow down the gains before
+    trying them on the robot.
+
+    Run as a script to sweep a grid around the wall follower's gains and
+    print the best few. """
+from __future__ import division
+import numpy as np
+
+from wall_plant import WallPlant
+
+# The wall follower's PID mode, see WallFollower.decide_speeds
+SPEED_MID = -0.14
+SPEED_RANGE = -0.2
+DISTANCE_MIDPOINT = 200.0  # mm
+DISTANCE_RANGE = 150.0  # mm
+
+
+class BatchPID():
+    """ Many PID.PID controllers stepped in lockstep, one per element of
+        the gain arrays, using array operations throughout.
+
+        Matches PID.PID with a fixed dt, set point 0, derivative on
+        measurement and an optional derivative low pass filter. """
+
+    def __init__(self, kp, ki, kd, windup=20.0, derivative_filter=0.0):
+        """ Constructor. The gains and windup are arrays, or scalars that
+            apply to every controller. """
+        kp, ki, kd, windup = np.broadcast_arrays(
+            *[np.asarray(value, dtype=float) for value in (kp, ki, kd, windup)])
+        self.Kp = kp.ravel()
+        self.Ki = ki.ravel()
+        self.Kd = kd.ravel()
+        self.windup_guard = windup.ravel()
+        self.derivative_filter = derivative_filter
+        self.clear()
+
+    def __len__(self):
+        return len(self.Kp)
+
+    def clear(self):
+        count = len(self)
+        self.PTerm = np.zeros(count)
+        self.ITerm = np.zeros(count)
+        self.DTerm = np.zeros(count)
+        self.output = np.zeros(count)
+        self.last_feedback = None
+
+    def update(self, feedback_value, dt):
+        """ Step every controller with its feedback (an array, or a
+            scalar they all see) over dt seconds. Returns the outputs. """
+        error = -np.asarray(feedback_value, dtype=float)
+
+        np.multiply(self.Kp, error, out=self.PTerm)
+        self.ITerm += error * dt
+        np.clip(self.ITerm, -self.windup_guard, self.windup_guard, out=self.ITerm)
+
+        if self.last_feedback is not None:
+            derivative = (self.last_feedback - feedback_value) / dt
+            if self.derivative_filter > 0:
+                alpha = dt / (self.derivative_filter + dt)
+                self.DTerm += alpha * (derivative - self.DTerm)
+            else:
+                self.DTerm[:] = derivative
+        self.last_feedback = feedback_value
+
+        self.output = self.PTerm + self.Ki * self.ITerm + self.Kd * self.DTerm
+        return self.output
+
+    def run_trace(self, feedback_trace, dt):
+        """ Feed every controller the same recorded feedback trace. Returns
+            the outputs, one row per step and one column per controller. """
+        self.clear()
+        return np.array([self.update(value, dt).copy() for value in feedback_trace])
+
+
+def gain_grid(kp_values, ki_values, kd_values, windup_values=(20.0,)):
+    """ Every combination of the given values, as flat (kp, ki, kd, windup)
+        arrays. """
+    grid = np.meshgrid(kp_values, ki_values, kd_values, windup_values, indexing='ij')
+    return [axis.ravel() for axis in grid]
+
+
+def sweep(kp, ki, kd, windup=20.0, start_distance=300.0, duration=10.0, dt=0.01,
+          sensor_period=0.033, noise=5.0, band=0.05, crash_distance=50.0,
+          derivative_filter=0.03, seed=0):
+    """ Drive a WallPlant per gain combination from start_distance towards
+        DISTANCE_MIDPOINT, the way WallFollower does, and score each run.
+
+        The lidar is sampled every sensor_period and held in between, with
+        gaussian noise of the given standard deviation (mm). Every run sees
+        the same noise.
+
+        Returns a dict of arrays, one element per combination:
+            overshoot:      furthest past the midpoint, % of the start offset
+            settling_time:  seconds until staying within band (a fraction of
+                            the start offset) of the midpoint, inf if never
+            oscillations:   times the distance crossed the midpoint
+            iae:            integral of absolute distance error (mm s)
+            crashed:        whether the robot got within crash_distance
+
+        The metrics are relative to the start offset, so start_distance
+        can't be DISTANCE_MIDPOINT. """
+    offset = start_distance - DISTANCE_MIDPOINT
+    if offset == 0:
+        raise ValueError("start_distance must be off the midpoint (%.0fmm)"
+                         % DISTANCE_MIDPOINT)
+
+    pid = BatchPID(kp, ki, kd, windup, derivative_filter)
+    count = len(pid)
+    plant = WallPlant(count, start_distance)
+    random = np.random.RandomState(seed)
+
+    steps = int(round(duration / dt))
+    hold_steps = max(1, int(round(sensor_period / dt)))
+
+    lowest = np.ones(count)  # Smallest error as a fraction of the start offset
+    last_outside = np.full(count, -1)
+    crossings = np.zeros(count, dtype=int)
+    iae = np.zeros(count)
+    crashed = np.zeros(count, dtype=bool)
+    last_sign = np.sign(np.full(count, offset))
+
+    measured = plant.measure()
+    for step in range(steps):
+        if step % hold_steps == 0:
+            measured = plant.measure() + random.normal(0.0, noise)
+
+        pid.update(measured - DISTANCE_MIDPOINT, dt)
+        deviation = np.clip(pid.output / DISTANCE_RANGE, -1.0, 1.0)
+        plant.step(SPEED_MID - deviation * SPEED_RANGE,
+                   SPEED_MID + deviation * SPEED_RANGE, dt)
+
+        error = plant.distance - DISTANCE_MIDPOINT
+        fraction = error / offset
+        np.minimum(lowest, fraction, out=lowest)
+        last_outside[np.abs(fraction) > band] = step
+        sign = np.sign(error)
+        crossings += (sign * last_sign) < 0
+        last_sign = np.where(sign != 0, sign, last_sign)
+        iae += np.abs(error) * dt
+        crashed |= plant.distance < crash_distance
+
+    settling_time = (last_outside + 1) * dt
+    settling_time[(last_outside == steps - 1) | crashed] = np.inf
+
+    return dict(
+        overshoot=np.maximum(-lowest, 0.0) * 100.0,
+        settling_time=settling_time,
+        oscillations=crossings,
+        iae=iae,
+        crashed=crashed)
+
+
+if __name__ == "__main__":
+    kp, ki, kd, windup = gain_grid(
+        np.linspace(0.1, 2.0, 20),
+        np.linspace(0.0, 0.5, 6),
+        np.linspace(0.0, 2.0, 21),
+        (5.0, 20.0))
+    results = sweep(kp, ki, kd, windup)
+
+    # Best first: didn't crash, settled with the least error
+    score = np.where(np.isfinite(results['settling_time']), results['iae'], np.inf)
+    order = np.lexsort((results['oscillations'], score, results['crashed']))
+
+    print("Swept %d gain combinations" % len(kp))
+    print("   Kp     Ki     Kd  windup  overshoot%  settle s  osc      IAE")
+    for index in order[:10]:
+        print("%5.2f  %5.2f  %5.2f  %6.1f  %10.1f  %8.2f  %3d  %7.0f" % (
+            kp[index], ki[index], kd[index], windup[index],
+            results['overshoot'][index], results['settling_time'][index],
+            results['oscillations'][index], results['iae'][index]))
+
+    current = sweep(0.5, 0.0, 0.1)
+    print("Current gains 0.50, 0.00, 0.10: overshoot %.1f%%, settle %.2fs, "
+          "%d oscillations, IAE %.0f" % (
+              current['overshoot'][0], current['settling_time'][0],
+              current['oscillations'][0], current['iae'][0]))
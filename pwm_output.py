@@ -0,0 +1,45 @@
+class PWMOutputStage():
+    """ Sits in front of an RPIO PWM.Servo and only writes a pulse width
+        when it has really changed.
+
+        Every set_servo call rewrites RPIO's DMA control blocks, so
+        writing the same value every tick is wasted work. A new width
+        within deadband microseconds of the last one written to that pin
+        is suppressed. Use exact to suppress only an identical width, eg.
+        for the end of a ramp, or force to write regardless, eg. to be
+        sure of neutral when stopping. """
+
+    def __init__(self, servo, deadband=0):
+        """ Constructor """
+        self.servo = servo
+        self.deadband = deadband
+        self.committed = {}
+
+        self.writes = 0
+        self.suppressed = 0
+
+    def set(self, pin, micros, force=False, exact=False):
+        """ Set a pin's pulse width. Returns whether it was written. """
+        last = self.committed.get(pin)
+        deadband = 0 if exact else self.deadband
+        if (not force and last is not None and
+                abs(micros - last) <= deadband):
+            self.suppressed += 1
+            return False
+
+        self.servo.set_servo(pin, micros)
+        self.committed[pin] = micros
+        self.writes += 1
+        return True
+
+    def forget(self, pin=None):
+        """ Drop what was last written to a pin (all pins if None), so the
+            next set writes whatever it's given, eg. after stop_servo. """
+        if pin is None:
+            self.committed = {}
+        else:
+            self.committed.pop(pin, None)
+
+    def stats(self):
+        """ Return (writes committed, writes suppressed). """
+        return self.writes, self.suppressed
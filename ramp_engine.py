@@ -0,0 +1,119 @@
+import threading
+
+import periodic
+
+
+class RampEngine():
+    """ Ramp servo pulse widths towards their targets from a background
+        thread, so that speed changes don't spin the wheels.
+
+        Control loops post targets with set_target(), which never blocks.
+        Every 1 / rate seconds each channel's current pulse width moves
+        towards its target by at most accel microseconds per second, or
+        decel when heading back towards neutral. Pulse widths go out
+        through output, a pwm_output.PWMOutputStage.
+
+        The limits default to the old Arduino sketch's ramp: full throttle
+        in half a second from neutral, 1200us per second. A channel isn't
+        written to until it's first given a target.
+
+        Pulse widths are written with the lock held, so a set_now() can't
+        be overwritten by a step worked out just before it. """
+
+    def __init__(self, output, rate=200.0):
+        """ Constructor """
+        self.output = output
+        self.period = 1.0 / rate
+        self.lock = threading.Lock()
+        self.killed = False
+        self.thread = None
+        self.executor = None
+
+        # pin: [target, current, accel, decel, neutral, active]
+        self.channels = {}
+
+    def add_channel(self, pin, neutral, accel=1200.0, decel=None):
+        """ Add a channel, starting at neutral. accel and decel are in
+            microseconds per second, decel defaults to accel. """
+        if decel is None:
+            decel = accel
+        with self.lock:
+            self.channels[pin] = [neutral, float(neutral), accel, decel,
+                                  neutral, False]
+
+    def set_limits(self, pin, accel, decel=None):
+        if decel is None:
+            decel = accel
+        with self.lock:
+            self.channels[pin][2] = accel
+            self.channels[pin][3] = decel
+
+    def set_target(self, pin, micros):
+        """ Ramp a channel towards micros. """
+        with self.lock:
+            channel = self.channels[pin]
+            channel[0] = micros
+            channel[5] = True
+
+    def set_now(self, pin, micros, force=False):
+        """ Jump a channel straight to micros, without ramping. force
+            writes it even if it's what was last written. """
+        with self.lock:
+            channel = self.channels[pin]
+            channel[0] = micros
+            channel[1] = float(micros)
+            channel[5] = True
+            self.output.set(pin, micros, force=force, exact=True)
+
+    def active(self, pin):
+        """ Whether a channel has been given a target yet. """
+        return self.channels[pin][5]
+
+    def current(self, pin):
+        """ The pulse width a channel is at now. """
+        return self.channels[pin][1]
+
+    def step(self, dt):
+        """ Move every channel on by dt seconds. """
+        with self.lock:
+            for pin, channel in self.channels.items():
+                target, current, accel, decel, neutral, active = channel
+                if not active:
+                    continue
+                difference = target - current
+                if difference:
+                    # Heading back towards neutral is slowing down
+                    if abs(target - neutral) < abs(current - neutral):
+                        limit = decel * dt
+                    else:
+                        limit = accel * dt
+                    current += max(-limit, min(limit, difference))
+                    channel[1] = current
+                # Land exactly on the target, whatever the deadband
+                self.output.set(pin, int(round(current)),
+                                exact=current == target)
+
+    def start(self):
+        """ Start the ramp thread. """
+        self.killed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the ramp thread, leaving channels where they are. Only
+            for shutting down: targets set afterwards are never reached. """
+        self.killed = True
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        self.executor = periodic.PeriodicExecutor(self.period)
+        last = self.executor.elapsed()
+        while not self.killed:
+            now = self.executor.elapsed()
+            # Use the real time step, so an overrun doesn't slow the ramp
+            self.step(now - last)
+            last = now
+            self.executor.wait()
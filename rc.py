@@ -1,5 +1,12 @@
 import core
-import time
+import periodic
+import telemetry
+
+JOYSTICK_FAILED = telemetry.event(
+    "joystick_failed", "Failed to get Joystick", telemetry.WARNING)
+JOYSTICKS = telemetry.event(
+    "joysticks", "Joysticks left %f, %f right %f, %f")
+MOTORS = telemetry.event("rc_motors", "Motors %f, %f")
 
 
 class rc:
@@ -9,6 +16,7 @@ class rc:
         self.core_module = core_module
         self.wiimote = wm
         self.ticks = 0
+        self.tick_time = 0.05
 
         # Store Max joystick values for left/right
         self.l_max_x = -1
@@ -86,6 +94,10 @@ class rc:
         """ Main Challenge method. Has to exist and is the
             start point for the threaded challenge. """
 
+        # Run at a fixed rate to allow other stuff to happen
+        # and not over burden Pi and Arduino.
+        executor = periodic.PeriodicExecutor(self.tick_time)
+
         # Loop indefinitely, or until this thread is flagged as stopped.
         while self.wiimote and not self.killed:
             # While in RC mode, get joystick states and pass speeds to motors.
@@ -95,7 +107,7 @@ class rc:
                 r_joystick_state = \
                     self.wiimote.get_classic_joystick_state(False)
             except:
-                print("Failed to get Joystick")
+                telemetry.log(JOYSTICK_FAILED)
 
             # Show Joystick Min/Max raw values for calibration
             # self.show_joystick_calibration(
@@ -103,12 +115,6 @@ class rc:
             #     r_joystick_state
             # )
 
-            # Annotate joystick states to screen
-            if l_joystick_state:
-                print("l_joystick_state: {}".format(l_joystick_state))
-            if r_joystick_state:
-                print("r_joystick_state: {}".format(r_joystick_state))
-
             # Grab normalised x,y / steering,throttle
             # from left and right joysticks.
             l_joystick_pos = l_joystick_state['state']['normalised']
@@ -116,13 +122,18 @@ class rc:
             r_joystick_pos = r_joystick_state['state']['normalised']
             r_steering, r_throttle = r_joystick_pos
 
+            # Annotate joystick states
+            telemetry.log(JOYSTICKS, l_steering, l_throttle,
+                          r_steering, r_throttle)
+
             if self.core_module:
                 self.core_module.throttle(l_throttle, r_throttle)
-            print ("Motors %f, %f" % (l_throttle, r_throttle))
+            telemetry.log(MOTORS, l_throttle, r_throttle)
+
+            self.ticks += 1
+            executor.wait()
 
-            # Sleep between loops to allow other stuff to
-            # happen and not over burden Pi and Arduino.
-            time.sleep(0.05)
+        print("Timing: %s" % executor.summary())
 
 
 if __name__ == "__main__":
@@ -134,5 +145,5 @@ if __name__ == "__main__":
         # except (Exception, KeyboardInterrupt) as e:
         # Stop any active threads before leaving
         rc.stop()
-        core.set_neutral()
+        core.shutdown()
         print("Quitting")
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+""" Record every control tick of a run to a binary file, and replay a
+    recorded run through a WallFollower as fast as the CPU allows. """
+import mmap
+import struct
+import sys
+
+from lidar_filter import OUT_OF_RANGE
+
+MAGIC = b'PWRUN002'
+
+# magic, record size, record count,
+# how the run was made: tick time (s), pipelined, paced in real time, and
+# the PID's clock reading before the first tick
+HEADER = struct.Struct('<8sIIdBBd')
+
+# tick, the PID's time for the tick,
+# left, front, right lidar distances (mm),
+# PID P, I, D terms and output,
+# left, right motor speeds
+RECORD = struct.Struct('<Id3f4f2f')
+
+# Field positions within an unpacked record
+TICK = 0
+TIME = 1
+DISTANCES = 2
+PID_TERMS = 5
+MOTORS = 9
+
+
+class RunRecorder():
+    """ Append fixed width tick records to a memory mapped file.
+
+        The file is sized for max_records up front, so recording a tick
+        is a single struct.pack_into. Ticks beyond max_records are
+        counted in self.dropped and not stored.
+
+        tick_time, pipelined, realtime and start_time describe the run, so
+        that replay() can set a follower up the same way. """
+
+    def __init__(self, path, max_records=6000, tick_time=0.01, pipelined=True,
+                 realtime=True, start_time=0.0):
+        """ Constructor """
+        self.max_records = max_records
+        self.count = 0
+        self.dropped = 0
+        self.tick_time = tick_time
+        self.pipelined = pipelined
+        self.realtime = realtime
+        self.start_time = start_time
+
+        size = HEADER.size + RECORD.size * max_records
+        self.file = open(path, 'w+b')
+        self.file.truncate(size)
+        self.map = mmap.mmap(self.file.fileno(), size)
+        self.write_header()
+
+    def write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, RECORD.size, self.count,
+                         self.tick_time, self.pipelined, self.realtime,
+                         self.start_time)
+
+    def record(self, tick, timestamp, distances, pid_terms, motors):
+        """ Store one tick. distances is (left, front, right), pid_terms
+            is (P, I, D, output) and motors is (left, right). """
+        if self.count >= self.max_records:
+            self.dropped += 1
+            return
+        offset = HEADER.size + RECORD.size * self.count
+        RECORD.pack_into(self.map, offset, tick, timestamp,
+                         distances[0], distances[1], distances[2],
+                         pid_terms[0], pid_terms[1], pid_terms[2], pid_terms[3],
+                         motors[0], motors[1])
+        self.count += 1
+        self.write_header()
+
+    def close(self):
+        """ Flush and trim the file to the records actually written. """
+        self.map.flush()
+        self.map.close()
+        self.file.truncate(HEADER.size + RECORD.size * self.count)
+        self.file.close()
+
+
+class RunLog():
+    """ Read access to a recorded run. Indexing returns the unpacked
+        record tuple, see RECORD for the field order. The settings the run
+        was made with are in tick_time, pipelined, realtime and
+        start_time. """
+
+    def __init__(self, path):
+        """ Constructor """
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            raise ValueError("%s is not a run recording" % path)
+        (magic, record_size, self.count, self.tick_time, pipelined, realtime,
+         self.start_time) = HEADER.unpack_from(self.map, 0)
+        self.pipelined = bool(pipelined)
+        self.realtime = bool(realtime)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise ValueError("%s is not a run recording" % path)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0 or index >= self.count:
+            raise IndexError(index)
+        return RECORD.unpack_from(self.map, HEADER.size + RECORD.size * index)
+
+    def __iter__(self):
+        for index in range(self.count):
+            yield self[index]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+
+class ReplayCore():
+    """ Stands in for core.Core, feeding a challenge the lidar readings of
+        a recorded run and collecting the motor commands it makes.
+
+        Each throttle() call ends a tick. When the recording runs out
+        on_finished is called, eg. to stop the challenge. """
+
+    def __init__(self, log, on_finished=None):
+        """ Constructor """
+        self.log = log
+        self.on_finished = on_finished
+        self.tick = 0
+        self.commands = []
+
+    def enable_motors(self, enable):
+        pass
+
+    def read_filtered(self, pin):
+        distance = self.log[self.tick][DISTANCES + pin]
+        return distance, 0.0, distance < OUT_OF_RANGE
+
+    def read_sensor(self, pin, with_age=False):
+        distance = self.log[self.tick][DISTANCES + pin]
+        if with_age:
+            return distance, 0.0
+        return distance
+
+    def throttle(self, left_speed, right_speed):
+        self.commands.append((left_speed, right_speed))
+        self.tick += 1
+        if self.tick >= len(self.log) and self.on_finished:
+            self.on_finished()
+
+    def direct_speed(self, left_speed, right_speed):
+        self.throttle(left_speed, right_speed)
+
+    def set_neutral(self):
+        pass
+
+    def stop(self):
+        pass
+
+
+def replay(path, follower_class=None):
+    """ Run a recorded run's readings through a fresh WallFollower with no
+        sleeping between ticks, set up with the run's tick time and
+        pipelining. If the run was in real time the PID reads the recorded
+        times from its clock, as it did on the robot, otherwise it gets a
+        tick_time step each tick. Returns a list of
+        (recorded motors, replayed motors) pairs, one per tick. """
+    if follower_class is None:
+        from wall_follower import WallFollower as follower_class
+
+    log = RunLog(path)
+    replay_core = ReplayCore(log)
+    follower = follower_class(replay_core)
+    replay_core.on_finished = follower.stop
+    follower.set_pipelined(log.pipelined)
+    follower.tick_time = log.tick_time
+    follower.realtime = False
+    if log.realtime:
+        follower.pid_clocked = True
+        follower.pidc.clock = lambda: log[replay_core.tick][TIME]
+        follower.pidc.last_time = log.start_time
+    follower.time_limit = len(log) * follower.tick_time
+    if len(log):
+        follower.run()
+
+    recorded = [record[MOTORS:MOTORS + 2] for record in log]
+    log.close()
+    return list(zip(recorded, replay_core.commands))
+
+
+if __name__ == "__main__":
+    results = replay(sys.argv[1])
+    worst = 0.0
+    for recorded, replayed in results:
+        worst = max(worst,
+                    abs(recorded[0] - replayed[0]),
+                    abs(recorded[1] - replayed[1]))
+    print("Replayed %d ticks, largest motor difference %f" % (len(results), worst))
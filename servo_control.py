@@ -1,21 +1,77 @@
-from numpy import interp
+import numpy
 
 
-class Servo_Controller():
+class Servo_Controller(object):
+    """ Map abstract speeds in [-1, 1] to servo pulse widths.
+
+        -1 maps to servo_min, 0 to servo_mid and 1 to servo_max (the other
+        way round if reversed), in a straight line either side of the
+        midpoint. The slopes are worked out whenever one of the settings
+        changes, which Calibration does by assigning them directly, so
+        they're properties. Any ServoGroup the controller is in is
+        told too. """
 
     def __init__(self, min, mid, max, bReverse):
-        self.servo_min = min
-        self.servo_mid = mid
-        self.servo_max = max
-        self.servo_reversed = bReverse
+        self.groups = []
+        self._servo_min = min
+        self._servo_mid = mid
+        self._servo_max = max
+        self._servo_reversed = bReverse
+        self.update_mapping()
+
+    def update_mapping(self):
+        """ Precompute the two halves of the speed to micros mapping. """
+        if self._servo_reversed:
+            low_end, high_end = self._servo_max, self._servo_min
+        else:
+            low_end, high_end = self._servo_min, self._servo_max
+        self.low_slope = self._servo_mid - low_end
+        self.high_slope = high_end - self._servo_mid
+        for group in self.groups:
+            group.update_mapping()
+
+    @property
+    def servo_min(self):
+        return self._servo_min
+
+    @servo_min.setter
+    def servo_min(self, value):
+        self._servo_min = value
+        self.update_mapping()
+
+    @property
+    def servo_mid(self):
+        return self._servo_mid
+
+    @servo_mid.setter
+    def servo_mid(self, value):
+        self._servo_mid = value
+        self.update_mapping()
+
+    @property
+    def servo_max(self):
+        return self._servo_max
+
+    @servo_max.setter
+    def servo_max(self, value):
+        self._servo_max = value
+        self.update_mapping()
+
+    @property
+    def servo_reversed(self):
+        return self._servo_reversed
+
+    @servo_reversed.setter
+    def servo_reversed(self, value):
+        self._servo_reversed = value
+        self.update_mapping()
 
     def micros(self, fSpeed):
         # Map an abstract speed in [1, -1] to servo control microseconds
-        micros = 0
-        if(self.servo_reversed):
-            micros = interp(fSpeed, [-1, 1], [self.servo_max, self.servo_min])
+        if fSpeed < 0:
+            micros = self._servo_mid + max(fSpeed, -1.0) * self.low_slope
         else:
-            micros = interp(fSpeed, [-1, 1], [self.servo_min, self.servo_max])
+            micros = self._servo_mid + min(fSpeed, 1.0) * self.high_slope
         return int(micros)
 
     def set_min(self, newmin):
@@ -32,6 +88,43 @@ class Servo_Controller():
 
     def adjust_range(self, adjust_value):
         """ Increment or decrement entire range by a given value. """
-        self.set_min(self.servo_min + adjust_value)
-        self.set_max(self.servo_max + adjust_value)
-        self.set_mid(self.servo_mid + adjust_value)
+        self._servo_min += adjust_value
+        self._servo_max += adjust_value
+        self._servo_mid += adjust_value
+        self.update_mapping()
+
+
+
+class ServoGroup(object):
+    """ Several Servo_Controllers mapped in one go, eg. both drive motors.
+
+        The controllers' midpoints and slopes are stacked into arrays,
+        kept up to date as the controllers change, so micros_many() maps
+        a speed per channel with a few array operations however many
+        channels there are. """
+
+    def __init__(self, controllers):
+        self.controllers = list(controllers)
+        for controller in self.controllers:
+            controller.groups.append(self)
+        self.update_mapping()
+
+    def update_mapping(self):
+        """ Restack the controllers' mappings. """
+        self.mid = numpy.array(
+            [controller.servo_mid for controller in self.controllers],
+            dtype=float)
+        self.low_slope = numpy.array(
+            [controller.low_slope for controller in self.controllers],
+            dtype=float)
+        self.high_slope = numpy.array(
+            [controller.high_slope for controller in self.controllers],
+            dtype=float)
+
+    def micros_many(self, speeds):
+        """ Map a speed in [-1, 1] per controller, in order, to servo
+            control microseconds. Returns a list of ints, the same as
+            each controller's micros() would give. """
+        speeds = numpy.clip(numpy.asarray(speeds, dtype=float), -1.0, 1.0)
+        slopes = numpy.where(speeds < 0, self.low_slope, self.high_slope)
+        return (self.mid + speeds * slopes).astype(int).tolist()
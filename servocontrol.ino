@@ -1,6 +1,9 @@
 #include <Servo.h>
 
+// Always start at this rate, the host can ask for a faster one
 #define SERIAL_BOARD_RATE 9600
+// Milliseconds to wait for a frame at a new baud rate before dropping back
+#define BAUD_PROBATION 1000
 
 // Millisecond timeout. If timeout reached, neutral is automatically kicked in.v
 #define SAFETY_TIMEOUT 5000
@@ -27,6 +30,28 @@
 
 #define MAX_PARAMS 3
 
+// Message types, the same for text and binary commands
+#define MESSAGE_THROTTLE 1
+#define MESSAGE_DIRECT 2
+#define MESSAGE_CALIBRATE 3
+#define MESSAGE_SENSOR 4
+#define MESSAGE_BAUD 5
+#define MESSAGE_PING 6
+#define MESSAGE_SUBSCRIBE 7
+#define MESSAGE_STREAM 8
+
+// Binary frames: SYNC, type, payload length, little-endian payload, CRC8
+// (polynomial 0x07) over type, length and payload. The sync byte can't
+// appear in a text command, which is how the two are told apart.
+#define SYNC_BYTE 0xA5
+#define MAX_PAYLOAD 16
+
+#define FRAME_IDLE 0
+#define FRAME_TYPE 1
+#define FRAME_LENGTH 2
+#define FRAME_PAYLOAD 3
+#define FRAME_CRC 4
+
 #define LED 2
 
 int SERVO_MAX = 2100;
@@ -42,6 +67,23 @@ double m_duSPerMilliSec = 0.0;
 double dRangeuS = (SERVO_MAX - SERVO_MIN) / 2.0;
 bool LEDdebug = false;
 
+// Binary frame being read in
+byte m_nFrameState = FRAME_IDLE;
+byte m_nFrameType = 0;
+byte m_nFrameLength = 0;
+byte m_nFrameCount = 0;
+byte m_nFrameCRC = 0;
+byte m_abFramePayload[MAX_PAYLOAD];
+
+unsigned long m_nBaudRate = SERIAL_BOARD_RATE;
+unsigned long m_nBaudChangeMilli = 0;
+bool m_bBaudProbation = false;
+
+// Telemetry stream, off while the period is 0
+unsigned int m_nStreamPeriod = 0;
+unsigned long m_nLastStreamMilli = 0;
+bool m_bSafetyCutout = false;
+
 // Servo-style motor controllers
 Servo lServo;
 Servo rServo;
@@ -223,6 +265,204 @@ void parse_command()
   }
 }
 
+byte crc8_update(byte crc, byte bData)
+{
+  // CRC8 with polynomial 0x07, one byte at a time
+  crc ^= bData;
+  for (int i=0; i<8; i++)
+  {
+    if (crc & 0x80)
+      crc = (crc << 1) ^ 0x07;
+    else
+      crc = crc << 1;
+  }
+  return crc;
+}
+
+unsigned int read_uint16(int nOffset)
+{
+  return m_abFramePayload[nOffset] | ((unsigned int)m_abFramePayload[nOffset+1] << 8);
+}
+
+unsigned long read_uint32(int nOffset)
+{
+  return (unsigned long)read_uint16(nOffset) | ((unsigned long)read_uint16(nOffset+2) << 16);
+}
+
+void send_frame(byte bType, byte* abPayload, byte nLength)
+{
+  byte crc = crc8_update(0, bType);
+  crc = crc8_update(crc, nLength);
+  Serial.write(SYNC_BYTE);
+  Serial.write(bType);
+  Serial.write(nLength);
+  for (int i=0; i<nLength; i++)
+  {
+    Serial.write(abPayload[i]);
+    crc = crc8_update(crc, abPayload[i]);
+  }
+  Serial.write(crc);
+}
+
+void write_uint16(byte* abBuffer, int nOffset, unsigned int nValue)
+{
+  abBuffer[nOffset] = (byte)nValue;
+  abBuffer[nOffset+1] = (byte)(nValue >> 8);
+}
+
+void send_stream_frame(unsigned long nMillis)
+{
+  // Timestamp, VSENSE, actual (ramped) and target motor outputs in uS,
+  // and whether the safety cutout is on
+  byte abFrame[15];
+  write_uint16(abFrame, 0, (unsigned int)nMillis);
+  write_uint16(abFrame, 2, (unsigned int)(nMillis >> 16));
+  write_uint16(abFrame, 4, analogRead(VSENSE_PIN));
+  write_uint16(abFrame, 6, (unsigned int)m_dMotors_Current_uS[LEFT_MOTOR]);
+  write_uint16(abFrame, 8, (unsigned int)m_dMotors_Current_uS[RIGHT_MOTOR]);
+  write_uint16(abFrame, 10, (unsigned int)m_dMotors_Target_uS[LEFT_MOTOR]);
+  write_uint16(abFrame, 12, (unsigned int)m_dMotors_Target_uS[RIGHT_MOTOR]);
+  abFrame[14] = m_bSafetyCutout;
+  send_frame(MESSAGE_STREAM, abFrame, 15);
+}
+
+void change_baud(unsigned long nBaud)
+{
+  // Only rates the 16MHz clock can make closely enough
+  if (nBaud != 9600 && nBaud != 19200 && nBaud != 38400 &&
+      nBaud != 57600 && nBaud != 115200)
+    nBaud = m_nBaudRate;
+
+  // Reply with the rate we're going to use, at the old rate
+  byte abReply[4] = {(byte)nBaud, (byte)(nBaud >> 8),
+                     (byte)(nBaud >> 16), (byte)(nBaud >> 24)};
+  send_frame(MESSAGE_BAUD, abReply, 4);
+  if (nBaud == m_nBaudRate)
+    return;
+
+  Serial.flush(); // Wait for the reply to go out
+  Serial.end();
+  Serial.begin(nBaud, SERIAL_8N1);
+  m_nBaudRate = nBaud;
+
+  // Drop back unless the host talks to us at the new rate
+  m_nBaudChangeMilli = millis();
+  m_bBaudProbation = true;
+}
+
+void parse_frame()
+{
+  // Enact on a complete binary frame. Motor values are microseconds.
+  m_bBaudProbation = false;
+  m_nLastMilliSerial = millis();
+
+  switch(m_nFrameType)
+  {
+    case MESSAGE_THROTTLE:
+    {
+      if (m_nFrameLength == 4)
+      {
+        set_motor_target_speed(LEFT_MOTOR, read_uint16(0));
+        set_motor_target_speed(RIGHT_MOTOR, read_uint16(2));
+      }
+    } break;
+
+    case MESSAGE_DIRECT:
+    {
+      if (m_nFrameLength == 4)
+      {
+        set_motor_ACTUAL_speed(LEFT_MOTOR, read_uint16(0));
+        set_motor_ACTUAL_speed(RIGHT_MOTOR, read_uint16(2));
+      }
+    } break;
+
+    case MESSAGE_CALIBRATE:
+    {
+      if (m_nFrameLength == 4)
+      {
+        SERVO_NEUTRALS[0] = read_uint16(0);
+        SERVO_NEUTRALS[1] = read_uint16(2);
+      }
+    } break;
+
+    case MESSAGE_SENSOR:
+    {
+      // Reply with the request's tag byte, so the host can match it up,
+      // then the analog sensor on A0
+      if (m_nFrameLength == 1)
+      {
+        unsigned int v_in = analogRead(VSENSE_PIN);
+        byte abReply[3] = {m_abFramePayload[0], (byte)v_in, (byte)(v_in >> 8)};
+        send_frame(MESSAGE_SENSOR, abReply, 3);
+      }
+    } break;
+
+    case MESSAGE_BAUD:
+    {
+      if (m_nFrameLength == 4)
+        change_baud(read_uint32(0));
+    } break;
+
+    case MESSAGE_PING:
+    {
+      send_frame(MESSAGE_PING, m_abFramePayload, m_nFrameLength);
+    } break;
+
+    case MESSAGE_SUBSCRIBE:
+    {
+      // Stream period in milliseconds, 0 to stop
+      if (m_nFrameLength == 2)
+      {
+        m_nStreamPeriod = read_uint16(0);
+        m_nLastStreamMilli = millis();
+      }
+    } break;
+  }
+}
+
+void read_frame_byte(byte bByte)
+{
+  // Run one received byte through the binary frame state machine.
+  // Anything malformed is dropped and we wait for the next sync byte.
+  switch(m_nFrameState)
+  {
+    case FRAME_IDLE:
+      m_nFrameState = FRAME_TYPE; // bByte is the sync byte
+      break;
+
+    case FRAME_TYPE:
+      m_nFrameType = bByte;
+      m_nFrameCRC = crc8_update(0, bByte);
+      m_nFrameState = FRAME_LENGTH;
+      break;
+
+    case FRAME_LENGTH:
+      if (bByte > MAX_PAYLOAD)
+      {
+        m_nFrameState = FRAME_IDLE;
+        break;
+      }
+      m_nFrameLength = bByte;
+      m_nFrameCount = 0;
+      m_nFrameCRC = crc8_update(m_nFrameCRC, bByte);
+      m_nFrameState = bByte ? FRAME_PAYLOAD : FRAME_CRC;
+      break;
+
+    case FRAME_PAYLOAD:
+      m_abFramePayload[m_nFrameCount++] = bByte;
+      m_nFrameCRC = crc8_update(m_nFrameCRC, bByte);
+      if (m_nFrameCount == m_nFrameLength)
+        m_nFrameState = FRAME_CRC;
+      break;
+
+    case FRAME_CRC:
+      m_nFrameState = FRAME_IDLE;
+      if (bByte == m_nFrameCRC)
+        parse_frame();
+      break;
+  }
+}
+
 void read_command()
 {
   // Read serial comms if available
@@ -232,7 +472,16 @@ void read_command()
     // Blink for each character read
     //blink_LED(1);
 
-    char chChar = Serial.read();
+    byte bByte = Serial.read();
+
+    // A sync byte starts a binary frame, which runs to its CRC
+    if (m_nFrameState != FRAME_IDLE || bByte == SYNC_BYTE)
+    {
+      read_frame_byte(bByte);
+      continue;
+    }
+
+    char chChar = bByte;
     m_szString += chChar;
 
     if (chChar == ']')
@@ -263,6 +512,15 @@ void loop()
   if (m_nLastMilli == 0)
     m_nLastMilli = nMillis;
 
+  // Go back to the starting baud rate if the host didn't follow us
+  if (m_bBaudProbation && millis() - m_nBaudChangeMilli > BAUD_PROBATION)
+  {
+    Serial.end();
+    Serial.begin(SERIAL_BOARD_RATE, SERIAL_8N1);
+    m_nBaudRate = SERIAL_BOARD_RATE;
+    m_bBaudProbation = false;
+  }
+
   // Safety cutout timer
   int nSerialDiff = nMillis-m_nLastMilliSerial;
   if (nSerialDiff>SAFETY_TIMEOUT)
@@ -274,9 +532,13 @@ void loop()
 
     // Turn on LED when in safety cutout mode
     digitalWrite(LED, HIGH);
+    m_bSafetyCutout = true;
   }
   else
+  {
     digitalWrite(LED, LOW);
+    m_bSafetyCutout = false;
+  }
 
   // Loop motors [L/R] and update current voltage value based on acceleration ramps.
   int nMilliDiff = nMillis-m_nLastMilli;
@@ -314,9 +576,17 @@ void loop()
     analogWrite(RIGHT_MOTOR_PIN, micros_to_byte(m_dMotors_Current_uS[RIGHT_MOTOR], false));
   }
 
+  // Push the telemetry stream if the host subscribed to it
+  unsigned long nStreamMillis = millis();
+  if (m_nStreamPeriod && nStreamMillis - m_nLastStreamMilli >= m_nStreamPeriod)
+  {
+    send_stream_frame(nStreamMillis);
+    m_nLastStreamMilli = nStreamMillis;
+  }
+
   // Blink once each time round loop for status.
   //blink_LED(1);
     
   // Must always update nLastMilli!
   m_nLastMilli = nMillis;
-}
+}
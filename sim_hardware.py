@@ -0,0 +1,368 @@
+""" In-process stand-ins for the Pi's hardware libraries, so that the
+    control code can run on a plain Linux box. See hardware.py for how
+    they get picked. """
+import collections
+import time
+
+
+class SimGPIO():
+    """ Enough of the RPi.GPIO module to drive inputs, outputs and edge
+        callbacks from a test or simulation.
+
+        Call trigger(pin) to simulate an edge on an input; any callback
+        registered for a matching edge runs in the caller's thread. """
+
+    BCM = 11
+    BOARD = 10
+
+    IN = 1
+    OUT = 0
+
+    HIGH = 1
+    LOW = 0
+
+    PUD_OFF = 20
+    PUD_DOWN = 21
+    PUD_UP = 22
+
+    RISING = 31
+    FALLING = 32
+    BOTH = 33
+
+    def __init__(self):
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.callbacks = {}
+
+    def setwarnings(self, enable):
+        pass
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setup(self, pin, direction, pull_up_down=PUD_OFF, initial=None):
+        self.directions[pin] = direction
+        if initial is not None:
+            self.levels[pin] = initial
+        elif pull_up_down == self.PUD_UP:
+            self.levels[pin] = self.HIGH
+        else:
+            self.levels.setdefault(pin, self.LOW)
+
+    def output(self, pin, value):
+        self.levels[pin] = value
+
+    def input(self, pin):
+        return self.levels.get(pin, self.LOW)
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        self.callbacks[pin] = (edge, callback)
+
+    def remove_event_detect(self, pin):
+        self.callbacks.pop(pin, None)
+
+    def cleanup(self):
+        self.directions = {}
+        self.levels = {}
+        self.callbacks = {}
+
+    def trigger(self, pin, edge=FALLING):
+        """ Simulate an edge on an input pin. """
+        self.levels[pin] = self.LOW if edge == self.FALLING else self.HIGH
+        if pin in self.callbacks:
+            wanted, callback = self.callbacks[pin]
+            if callback and wanted in (edge, self.BOTH):
+                callback(pin)
+
+
+class SimPWM():
+    """ Stands in for the RPIO.PWM module. Use as PWM.Servo(). """
+
+    class Servo():
+        """ Records pulse widths instead of generating them. """
+
+        def __init__(self, pulse_incr_us=1, **kwargs):
+            self.pulse_widths = {}
+            self.writes = 0
+            # Most recent (pin, pulse width) writes, oldest first
+            self.history = collections.deque(maxlen=1000)
+
+        def set_servo(self, gpio, pulse_width_us):
+            self.pulse_widths[gpio] = pulse_width_us
+            self.writes += 1
+            self.history.append((gpio, pulse_width_us))
+
+        def stop_servo(self, gpio):
+            self.pulse_widths.pop(gpio, None)
+
+
+class SimI2CDevice():
+    """ A device on a SimI2CBus, backed by a register map.
+
+        Reads of a register come from script[reg] if there is one (an
+        iterator of values, the last value sticks), else from the
+        register map. Writes go to the register map and are logged. """
+
+    def __init__(self, registers=None):
+        self.registers = dict(registers or {})
+        self.scripts = {}
+        self.writes = []
+
+    def script(self, reg, values):
+        """ Make successive reads of reg return values in turn. """
+        self.scripts[reg] = iter(values)
+
+    def read(self, reg, length):
+        if reg in self.scripts:
+            try:
+                self.registers[reg] = next(self.scripts[reg])
+            except StopIteration:
+                del self.scripts[reg]
+        return [self.registers.get(reg + offset, 0) & 0xFF
+                for offset in range(length)]
+
+    def write(self, reg, data):
+        self.writes.append((reg, list(data)))
+        for offset, value in enumerate(data):
+            self.registers[reg + offset] = value
+
+
+class SimI2CBus():
+    """ Stands in for smbus.SMBus. Transactions to an address with no
+        device raise IOError, as on a real bus. """
+
+    def __init__(self, bus=1):
+        self.devices = {}
+        self.transactions = 0
+
+    def add_device(self, address, device=None):
+        if device is None:
+            device = SimI2CDevice()
+        self.devices[address] = device
+        return device
+
+    def remove_device(self, address):
+        self.devices.pop(address, None)
+
+    def device(self, address):
+        self.transactions += 1
+        if address not in self.devices:
+            raise IOError(121, "Remote I/O error")
+        return self.devices[address]
+
+    def write_byte(self, address, value):
+        self.device(address).write(value, [])
+
+    def read_byte_data(self, address, reg):
+        return self.device(address).read(reg, 1)[0]
+
+    def write_byte_data(self, address, reg, value):
+        self.device(address).write(reg, [value])
+
+    def read_i2c_block_data(self, address, reg, length=32):
+        return self.device(address).read(reg, length)
+
+    def write_i2c_block_data(self, address, reg, data):
+        self.device(address).write(reg, data)
+
+
+class SimToFLib():
+    """ Stands in for the vl53l0x_python shared library.
+
+        Distances come from distance_source(object_number) if set, else
+        from self.distances (set_distance). Reads sleep for the ranging
+        mode's timing budget times time_scale, like waiting for data
+        ready on a real sensor; set time_scale to 0 to run flat out.
+
+        Starting an object puts a VL53L0X at its address on the bus, so
+        address probing works as it does on the robot. """
+
+    TIMING_US = [33000, 66000, 200000, 33000, 20000]
+    MODEL_ID_REG = 0xC0
+    MODEL_ID = 0xEE
+
+    def __init__(self, bus, time_scale=1.0):
+        self.bus = bus
+        self.time_scale = time_scale
+        self.distance_source = None
+        self.distances = {}
+        self.modes = {}
+        self.addresses = {}
+
+    def set_distance(self, object_number, distance):
+        self.distances[object_number] = distance
+
+    def VL53L0X_set_i2c(self, read_func, write_func):
+        pass
+
+    def startRanging(self, object_number, mode, i2c_address,
+                     TCA9548A_Device=255, TCA9548A_Address=0):
+        self.modes[object_number] = mode
+        self.addresses[object_number] = i2c_address
+        self.bus.add_device(
+            i2c_address, SimI2CDevice({self.MODEL_ID_REG: self.MODEL_ID}))
+
+    def stopRanging(self, object_number):
+        self.modes.pop(object_number, None)
+
+    def setRangingMode(self, object_number, mode):
+        if object_number not in self.modes:
+            return -3
+        self.modes[object_number] = mode
+        return 0
+
+    def distance(self, object_number):
+        if self.distance_source:
+            return self.distance_source(object_number)
+        return self.distances.get(object_number, 8190)
+
+    def wait(self, object_number):
+        if self.time_scale:
+            time.sleep(self.TIMING_US[self.modes[object_number]] *
+                       self.time_scale / 1000000.0)
+
+    def getDistance(self, object_number):
+        if object_number not in self.modes:
+            return -1
+        self.wait(object_number)
+        return self.distance(object_number)
+
+    def getDistances(self, distances, statuses, count):
+        started = [n for n in range(count) if n in self.modes]
+        if started and self.time_scale:
+            # All sensors range in parallel, so wait for the slowest
+            self.wait(max(started, key=lambda n: self.TIMING_US[self.modes[n]]))
+        for object_number in range(count):
+            if object_number in self.modes:
+                distances[object_number] = self.distance(object_number)
+                statuses[object_number] = 0
+            else:
+                distances[object_number] = -1
+                statuses[object_number] = -3
+        return len(started)
+
+    def getDistanceList(self, objects, distances, statuses, count):
+        started = [objects[n] for n in range(count) if objects[n] in self.modes]
+        if started and self.time_scale:
+            self.wait(max(started, key=lambda n: self.TIMING_US[self.modes[n]]))
+        for index in range(count):
+            object_number = objects[index]
+            if object_number in self.modes:
+                distances[index] = self.distance(object_number)
+                statuses[index] = 0
+            else:
+                distances[index] = -1
+                statuses[index] = -3
+        return len(started)
+
+    def probeAddress(self, i2c_address, TCA9548A_Device=255,
+                     TCA9548A_Address=0):
+        try:
+            model_id = self.bus.read_byte_data(i2c_address, self.MODEL_ID_REG)
+        except IOError:
+            return 0
+        return int(model_id == self.MODEL_ID)
+
+    def getModeTimingBudget(self, mode):
+        if 0 <= mode < len(self.TIMING_US):
+            return self.TIMING_US[mode]
+        return 0
+
+    def getDev(self, object_number):
+        return object_number
+
+    def VL53L0X_GetMeasurementTimingBudgetMicroSeconds(self, dev, budget_p):
+        budget_p.contents.value = self.TIMING_US[self.modes[dev]]
+        return 0
+
+
+class SimWiimote():
+    """ Stands in for cwiid.Wiimote, playing back a script of
+        (seconds since connecting, state dict) pairs in time order.
+        Reading state gives the latest scripted state that is due, or
+        the idle state before the first one. """
+
+    def __init__(self, script=None):
+        self.led = 0
+        self.rpt_mode = 0
+        self.script = list(script or [])
+        self.connected_at = time.time()
+        self.current = {'buttons': 0}
+
+    @property
+    def state(self):
+        elapsed = time.time() - self.connected_at
+        while self.script and self.script[0][0] <= elapsed:
+            self.current = self.script.pop(0)[1]
+        return self.current
+
+    def close(self):
+        pass
+
+
+class SimCwiid():
+    """ Stands in for the cwiid module. Call script() with a list of
+        (seconds, state dict) pairs before connecting to drive the
+        controls, see SimWiimote. """
+
+    BTN_2 = 0x0001
+    BTN_1 = 0x0002
+    BTN_B = 0x0004
+    BTN_A = 0x0008
+    BTN_MINUS = 0x0010
+    BTN_HOME = 0x0080
+    BTN_LEFT = 0x0100
+    BTN_RIGHT = 0x0200
+    BTN_DOWN = 0x0400
+    BTN_UP = 0x0800
+    BTN_PLUS = 0x1000
+
+    CLASSIC_BTN_UP = 0x0001
+    CLASSIC_BTN_LEFT = 0x0002
+    CLASSIC_BTN_ZR = 0x0004
+    CLASSIC_BTN_X = 0x0008
+    CLASSIC_BTN_A = 0x0010
+    CLASSIC_BTN_Y = 0x0020
+    CLASSIC_BTN_B = 0x0040
+    CLASSIC_BTN_ZL = 0x0080
+    CLASSIC_BTN_R = 0x0200
+    CLASSIC_BTN_PLUS = 0x0400
+    CLASSIC_BTN_HOME = 0x0800
+    CLASSIC_BTN_MINUS = 0x1000
+    CLASSIC_BTN_L = 0x2000
+    CLASSIC_BTN_DOWN = 0x4000
+    CLASSIC_BTN_RIGHT = 0x8000
+
+    RPT_STATUS = 0x01
+    RPT_BTN = 0x02
+    RPT_ACC = 0x04
+    RPT_IR = 0x08
+    RPT_NUNCHUK = 0x10
+    RPT_CLASSIC = 0x20
+    RPT_BALANCE = 0x40
+    RPT_MOTIONPLUS = 0x80
+    RPT_EXT = 0xF0
+
+    def __init__(self):
+        self.states = None
+
+    def script(self, states):
+        self.states = states
+
+    def Wiimote(self, *args):
+        return SimWiimote(self.states)
+
+
+# Shared instances, so everything that imports hardware in simulation
+# talks to the same fake devices.
+gpio = SimGPIO()
+rpio = SimGPIO()
+i2c_bus = SimI2CBus()
+tof_lib = SimToFLib(i2c_bus)
+cwiid = SimCwiid()
+
+# A VL53L0X fresh out of reset, the OLED display and a TCA9548A
+i2c_bus.add_device(0x29, SimI2CDevice({SimToFLib.MODEL_ID_REG: SimToFLib.MODEL_ID}))
+i2c_bus.add_device(0x3C)
+i2c_bus.add_device(0x70)
@@ -0,0 +1,158 @@
+""" Telemetry for the control loops, without them waiting on a terminal.
+
+    Modules register each kind of message once, as an event with a
+    format string and a level, then log() just the numbers each time.
+    Records go into a preallocated ring buffer, and a background thread
+    formats and writes them out every so often.
+
+    Events below the current level are dropped as soon as they're
+    logged. The level comes from the PIWARS_TELEMETRY_LEVEL environment
+    variable (DEBUG, INFO or WARNING, default INFO), and output goes to
+    the file named by PIWARS_TELEMETRY_FILE, or stdout. """
+import atexit
+import os
+import sys
+import threading
+
+import numpy
+
+from clock import monotonic
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARNING: "WARNING"}
+
+# Most numbers a record can carry
+FIELDS = 4
+
+
+class Telemetry():
+    """ Ring buffer of fixed-shape records, (time, event, numbers), and
+        the thread that writes them out.
+
+        If the writer falls more than capacity records behind, the
+        oldest are overwritten and counted in self.lost. """
+
+    def __init__(self, capacity=4096, level=INFO, stream=None, interval=0.1,
+                 clock=monotonic):
+        """ Constructor """
+        self.capacity = capacity
+        self.level = level
+        self.stream = stream or sys.stdout
+        self.interval = interval
+        self.clock = clock
+
+        # Registered events: (name, format, level, number of fields)
+        self.events = []
+        self.event_levels = []
+        self.event_ids_by_name = {}
+
+        self.times = numpy.zeros(capacity)
+        self.event_ids = numpy.zeros(capacity, dtype=numpy.int32)
+        self.values = numpy.zeros((capacity, FIELDS))
+        self.written = 0
+        self.read = 0
+        self.lost = 0
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.killed = False
+        self.thread = None
+
+    def event(self, name, message, level=DEBUG):
+        """ Register a kind of record. message is a % format string for
+            up to FIELDS numbers. Returns the id to log it with. Names
+            are unique, so each line of output says where it came from. """
+        if name in self.event_ids_by_name:
+            raise ValueError("Event %s is already registered" % name)
+        fields = message.count('%') - 2 * message.count('%%')
+        if fields > FIELDS:
+            raise ValueError("Event %s has more than %d fields" % (name, FIELDS))
+        self.events.append((name, message, level, fields))
+        self.event_levels.append(level)
+        self.event_ids_by_name[name] = len(self.events) - 1
+        return len(self.events) - 1
+
+    def set_level(self, level):
+        self.level = level
+
+    def log(self, event_id, *values):
+        """ Record an event. Never waits on output. """
+        if self.event_levels[event_id] < self.level:
+            return
+
+        with self.lock:
+            if self.thread is None:
+                self.start()
+            index = self.written % self.capacity
+            self.times[index] = self.clock()
+            self.event_ids[index] = event_id
+            self.values[index, :len(values)] = values
+            self.written += 1
+
+    def start(self):
+        """ Start the writer thread. """
+        self.killed = False
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """ Stop the writer thread, writing out everything logged. """
+        self.killed = True
+        self.wake.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        self.drain()
+
+    def run(self):
+        while not self.killed:
+            self.wake.wait(self.interval)
+            self.drain()
+
+    def drain(self):
+        """ Format and write out the records logged since the last drain. """
+        with self.lock:
+            written = self.written
+            first = max(self.read, written - self.capacity)
+            self.lost += first - self.read
+            self.read = written
+            if first == written:
+                return
+            # Copy the records out, so logging can carry on meanwhile
+            indices = numpy.arange(first, written) % self.capacity
+            times = self.times[indices]
+            event_ids = self.event_ids[indices]
+            values = self.values[indices]
+
+        lines = []
+        for when, event_id, numbers in zip(times, event_ids, values):
+            name, message, level, fields = self.events[event_id]
+            lines.append("%.3f %s %s\n" % (
+                when, LEVEL_NAMES.get(level, level),
+                message % tuple(numbers[:fields])))
+        self.stream.write("".join(lines))
+        self.stream.flush()
+
+
+def configure():
+    """ Make the shared Telemetry from the environment. """
+    level = os.environ.get("PIWARS_TELEMETRY_LEVEL", "INFO").upper()
+    levels = dict((name, number) for number, name in LEVEL_NAMES.items())
+    if level not in levels:
+        raise ValueError("Unknown telemetry level %s" % level)
+
+    stream = None
+    path = os.environ.get("PIWARS_TELEMETRY_FILE")
+    if path:
+        stream = open(path, "a")
+    return Telemetry(level=levels[level], stream=stream)
+
+
+# Shared instance, so everything logs to the same place in time order
+recorder = configure()
+event = recorder.event
+log = recorder.log
+atexit.register(recorder.stop)
@@ -0,0 +1,69 @@
+""" Check that autotune's gains actually work on the wall_plant model.
+
+    Run with pytest, or as a script. """
+import autotune
+import pid_sweep
+import wall_plant
+
+
+class NeutralCore(wall_plant.PlantCore):
+    """ PlantCore that notes whether it was stopped or set to neutral. """
+
+    def __init__(self, **kwargs):
+        wall_plant.PlantCore.__init__(self, **kwargs)
+        self.stopped = False
+        self.neutral = False
+
+    def set_neutral(self):
+        self.neutral = True
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_process_gain():
+    # Small angles: the distance's acceleration per unit of PID output is
+    # forward speed times turn rate per unit of output
+    settings = autotune.Autotune(None)
+    forward = -settings.speed_mid * wall_plant.MAX_SPEED
+    turn = (-2 * settings.speed_range * wall_plant.MAX_SPEED /
+            wall_plant.TRACK_WIDTH / settings.distance_range)
+    expected = forward * turn
+    for seed in range(3):
+        tune = autotune.simulate(seed=seed)
+        gain, delay = tune.process
+        assert abs(gain - expected) < 0.15 * expected
+        assert delay < 0.1
+
+
+def test_gains_settle():
+    for rule in autotune.RULES:
+        for seed in range(3):
+            tune = autotune.simulate(rule, seed=seed)
+            assert tune.gains is not None
+            # From 100mm either side of the midpoint, settling within
+            # 10mm, a couple of times the sensor noise
+            for start in (300.0, 100.0):
+                results = pid_sweep.sweep(
+                    *tune.gains, start_distance=start, duration=15.0,
+                    band=0.1, seed=seed)
+                assert not results['crashed'][0], (rule, seed, start)
+                assert results['settling_time'][0] < 15.0, (rule, seed, start)
+                assert results['overshoot'][0] < 25.0, (rule, seed, start)
+
+
+def test_leaves_core_running():
+    plant_core = NeutralCore(noise=2.0)
+    tune = autotune.Autotune(plant_core)
+    tune.realtime = False
+    plant_core.dt = tune.tick_time
+    tune.run()
+    assert plant_core.neutral
+    assert not plant_core.stopped
+
+
+if __name__ == "__main__":
+    test_process_gain()
+    test_gains_settle()
+    test_leaves_core_running()
+    print("OK")
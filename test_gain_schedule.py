@@ -0,0 +1,95 @@
+""" Check that the scheduled wall follower steers exactly as the
+    formulas it replaced, over every wall distance the lidar can give.
+
+    Run with pytest, or as a script. """
+import os
+
+import numpy as np
+
+# Off the robot
+os.environ.setdefault("PIWARS_BACKEND", "sim")
+
+import PID
+import wall_follower
+from lidar_filter import OUT_OF_RANGE
+
+# Further than the table's grid either way, out to nothing in range
+DISTANCES = np.concatenate((np.linspace(-500.0, 2000.0, 2501),
+                            [4000.0, float(OUT_OF_RANGE)]))
+
+
+def old_speeds(mode, sensorvalue, follow_left, pidc=None, dt=None):
+    """ decide_speeds as it was before the tables. """
+    if mode == "LINEAR":
+        speed_mid = -0.2
+        speed_range = 0.06
+        deviation = (sensorvalue - 200.0) / 100.0
+        deviation = max(-1.0, min(1.0, deviation))
+    elif mode == "EXPO":
+        speed_mid = 0.05
+        speed_range = 0.05
+        deviation = (sensorvalue - 200.0) / 100.0
+        if deviation < 0:
+            deviation = 0 - (deviation * deviation)
+        else:
+            deviation = deviation * deviation
+        return (speed_mid - (deviation * speed_range),
+                speed_mid + (deviation * speed_range))
+    else:
+        speed_mid = -0.14
+        speed_range = -0.2
+        pidc.update(sensorvalue - 200.0, dt)
+        deviation = max(-1.0, min(1.0, pidc.output / 150.0))
+
+    if follow_left:
+        return (speed_mid - (deviation * speed_range),
+                speed_mid + (deviation * speed_range))
+    return (speed_mid + (deviation * speed_range),
+            speed_mid - (deviation * speed_range))
+
+
+def make_follower(mode, follow_left):
+    follower = wall_follower.WallFollower(None)
+    follower.realtime = False
+    follower.follow_left = follow_left
+    follower.set_control_mode(mode)
+    return follower
+
+
+def reference_pid(follower):
+    pidc = PID.PID(follower.pidc.Kp, follower.pidc.Ki, follower.pidc.Kd)
+    pidc.setDerivativeOnMeasurement(True)
+    pidc.setDerivativeFilter(0.03)
+    return pidc
+
+
+def check(mode, tolerance):
+    for follow_left in (True, False):
+        follower = make_follower(mode, follow_left)
+        pidc = reference_pid(follower)
+        for distance in DISTANCES:
+            new = follower.decide_speeds(distance, False)
+            old = old_speeds(mode, distance, follow_left, pidc,
+                             follower.tick_time)
+            assert np.allclose(new, old, rtol=0, atol=tolerance), \
+                (mode, follow_left, distance, new, old)
+
+
+def test_linear():
+    check("LINEAR", 1e-9)
+
+
+def test_expo():
+    # Interpolating the quadratic on the grid, exact off it
+    check("EXPO", 2e-4)
+
+
+def test_pid():
+    check("PID", 1e-9)
+
+
+if __name__ == "__main__":
+    test_linear()
+    test_expo()
+    test_pid()
+    print("OK")
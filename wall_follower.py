@@ -1,9 +1,22 @@
 # Import triangula module to interact with SixAxis
 import core
 import time
+import collections
+import actuation
+import gain_schedule
 import PID
+import periodic
+import run_recorder
+import telemetry
+from lidar_filter import OUT_OF_RANGE
 # import sounds
 
+PID_OUT = telemetry.event("pid_out", "PID out: %f")
+DISTANCE = telemetry.event("distance", "Distance is %d")
+SWITCH_WALL = telemetry.event(
+    "switch_wall", "Distance above threshold, follow right", telemetry.INFO)
+MOTORS = telemetry.event("wall_motors", "Motors %f, %f")
+
 ''' 10-2-2017: This code is completely untested; don't be surprised when it 
 doesn't compile, run or do anything sensible.'''
 
@@ -16,120 +29,153 @@ class WallFollower:
         self.killed = False
         self.core = core_module
         self.ticks = 0
-        self.tick_time = 0.1 # How many seconds per control loop
         self.time_limit = 16 # How many seconds to run for
+        self.set_pipelined(True)
+
+        # Longest the lidar estimate gets carried forward between readings
+        self.max_prediction = 0.1
+
         self.follow_left = True
         self.switched_wall = False
 
+        # Last commanded forward speed, to look up the controller settings
+        self.forward_speed = 0.0
+
+        # Pace ticks in real time. Replays turn this off to run flat out.
+        self.realtime = True
+        # Let the PID time its own updates (True), or give it tick_time
+        # each tick (False). None for whichever suits realtime. Replays of
+        # real time runs use the PID's clock, reading the recorded times.
+        self.pid_clocked = None
+        self.executor = None
+
+        # Record every tick to this file, if set
+        self.record_path = None
+
 #known good for straight line, underdamped
 #        self.pidc = PID.PID(0.5, 0.0, 0.2)
 
 # test for maze: 
 #        self.pidc = PID.PID(0.5, 0.0, 0.1)
         self.pidc = PID.PID(0.5, 0.0, 0.1)
+        self.pidc.setDerivativeOnMeasurement(True)
+        self.pidc.setDerivativeFilter(0.03)
 
     def stop(self):
         """Simple method to stop the RC loop"""
         self.killed = True
 
+    def set_pipelined(self, pipelined):
+        """ Pipelined runs at 100Hz: actuation happens in a worker
+            thread while the next tick senses from the lidar cache.
+            Otherwise sense, compute and actuate in turn at 10Hz. """
+        self.pipelined = pipelined
+        if pipelined:
+            self.tick_time = 0.01 # How many seconds per control loop
+        else:
+            self.tick_time = 0.1
+
     def set_control_mode(self, mode):
+        """ Pick LINEAR, EXPO or PID steering and precompute its table.
+            The PID table starts from pidc's gains. """
         self.control_mode = mode
+        if mode == "PID":
+            self.schedule = gain_schedule.pid_table(
+                self.pidc.Kp, self.pidc.Ki, self.pidc.Kd)
+        else:
+            self.schedule = gain_schedule.TABLES[mode]()
 
     def decide_speeds(self, sensorvalue, ignore_d):
-        """ Set up return values at the start"""
-        leftspeed = 0
-        rightspeed = 0
-
-        if self.control_mode == "LINEAR":
-            speed_mid = -0.2
-            speed_range = 0.06
-            """ Deviation is distance from intended midpoint.
-                Right is positive, left is negative
-                Rate is how much to add/subtract from motor speed """
-
-            distance_midpoint = 200.0  # mm
-            distance_range = 100.0  # mm
-            deviation = (sensorvalue - distance_midpoint) / distance_range  # [-1, 1]
-
-            # Gate value to [-1,1] for the sake of not driving backwards
-            if (deviation < -1):
-                deviation = -1
-            if (deviation > 1):
-                deviation = 1
-            if self.follow_left:
-                leftspeed = (speed_mid - (deviation * speed_range))
-                rightspeed = (speed_mid + (deviation * speed_range))
-            else:
-                leftspeed = (speed_mid + (deviation * speed_range))
-                rightspeed = (speed_mid - (deviation * speed_range))
-
-
-            return leftspeed, rightspeed
-
-        elif self.control_mode == "EXPO":
-            speed_mid = 0.05
-            speed_range = 0.05
-
-            distance_midpoint = 200.0  # mm
-            distance_range = 100.0  # mm
-            deviation = (sensorvalue - distance_midpoint) / distance_range  # [-1, 1]
-
-            if (deviation < 0):
-                deviation = 0 - (deviation * deviation)
-            else:
-                deviation = deviation * deviation
-
+        """ Look up the controller settings for the current speed and
+            wall distance, and work out the motor speeds from them. """
+        settings = self.schedule.lookup(self.forward_speed, sensorvalue)
+
+        """ Deviation is how far to steer.
+            Right is positive, left is negative """
+        deviation = settings[gain_schedule.DEVIATION]
+        if settings[gain_schedule.PID_SCALE]:
+            self.pidc.setKp(settings[gain_schedule.KP])
+            self.pidc.setKi(settings[gain_schedule.KI])
+            self.pidc.setKd(settings[gain_schedule.KD])
+
+            error = (sensorvalue - self.schedule.midpoint)
+            # Off real time, give the PID the tick time rather than
+            # letting it time updates itself, unless told otherwise
+            clocked = self.pid_clocked
+            if clocked is None:
+                clocked = self.realtime
+            dt = None if clocked else self.tick_time
+            self.pidc.update(error, dt, ignore_d=ignore_d)
+
+            deviation += self.pidc.output * settings[gain_schedule.PID_SCALE]
+            telemetry.log(PID_OUT, deviation)
+
+        if self.schedule.clip:
+            deviation = max(-1.0, min(1.0, deviation))
+
+        speed_mid = settings[gain_schedule.SPEED_MID]
+        speed_range = settings[gain_schedule.SPEED_RANGE]
+        if self.follow_left or not self.schedule.mirror:
             leftspeed = (speed_mid - (deviation * speed_range))
             rightspeed = (speed_mid + (deviation * speed_range))
-
-        elif self.control_mode == "PID":
-# straight line, cautious: mid -0.2, range -0.2
-# maze, cautious: mid -0.1, range -0.2
-# maze, tuned: mid -0.14, range -0.2
-
-            speed_mid = -0.14
-            speed_range = -0.2
-
-            distance_midpoint = 200.0
-            distance_range = 150.0
-            error = (sensorvalue - distance_midpoint)
-            self.pidc.update(error, ignore_d)
-
-            deviation = self.pidc.output / distance_range
-            c_deviation = max( -1.0, min(1.0, deviation)) 
-
-            print("PID out: %f" % deviation)
-
-            if self.follow_left:
-                leftspeed = (speed_mid - (c_deviation * speed_range))
-                rightspeed = (speed_mid + (c_deviation * speed_range))
-            else:
-                leftspeed = (speed_mid + (c_deviation * speed_range))
-                rightspeed = (speed_mid - (c_deviation * speed_range))
-
         else:
-            leftspeed = speed_mid
-            rightspeed = speed_mid
+            leftspeed = (speed_mid + (deviation * speed_range))
+            rightspeed = (speed_mid - (deviation * speed_range))
 
+        self.forward_speed = -(leftspeed + rightspeed) / 2.0
         return leftspeed, rightspeed
 
+    def read_distance(self, pin):
+        """ Filtered distance from a lidar. A lidar with no good reading
+            recently is treated as seeing nothing in range. """
+        distance, rate, valid = self.core.read_filtered(pin)
+        if not valid:
+            return OUT_OF_RANGE
+        if self.pipelined:
+            # Several ticks go by between lidar readings at this rate, so
+            # carry the estimate forward at its rate of change, never back.
+            value, age = self.core.read_sensor(pin, with_age=True)
+            distance += rate * max(0.0, min(age, self.max_prediction))
+        return distance
+
     def run(self):
         print("Start run")
         """Read a sensor and set motor speeds accordingly"""
         self.core.enable_motors(True)
 
-        tick_limit = self.time_limit / self.tick_time
-
         self.set_control_mode("PID")
 
-        side_prox = 0
-        prev_prox = 100 # Make sure nothing bad happens on startup
-
-        while not self.killed and self.ticks < tick_limit and side_prox != -1:
-            prev_prox = side_prox
-            d_left = self.core.read_sensor(0)
-            d_front = self.core.read_sensor(1) - 150
-            d_right = self.core.read_sensor(2)
+        recorder = None
+        if self.record_path:
+            recorder = run_recorder.RunRecorder(
+                self.record_path, tick_time=self.tick_time,
+                pipelined=self.pipelined, realtime=self.realtime,
+                start_time=self.pidc.last_time)
+
+        # Side distances over the last 0.1s, to spot crossing the middle
+        # of the course at any tick rate
+        history = collections.deque(
+            maxlen=max(1, int(round(0.1 / self.tick_time))))
+        history.append(100) # Make sure nothing bad happens on startup
+
+        # Actuate in the background while the next tick runs, unless
+        # replaying, when commands have to go out in tick order.
+        worker = None
+        actuate = self.core.throttle
+        if self.pipelined and self.realtime:
+            worker = actuation.ActuationWorker(self.core.throttle)
+            worker.start()
+            actuate = worker.submit
+
+        self.executor = periodic.PeriodicExecutor(
+            self.tick_time, realtime=self.realtime)
+
+        while not self.killed and self.executor.elapsed() < self.time_limit:
+            prev_prox = history[0]
+            d_left = self.read_distance(0)
+            d_front_raw = self.read_distance(1)
+            d_front = d_front_raw - 150
+            d_right = self.read_distance(2)
 
             # Which wall are we following?
             if self.follow_left:
@@ -137,18 +183,19 @@ class WallFollower:
             else:
                 side_prox = d_right
             front_prox = d_front
+            history.append(side_prox)
 
             # Have we fallen out of the end of the course?
             if d_left > 400 and d_right > 400:
                 self.killed = True
                 break
 
-            print("Distance is %d" % (side_prox) )
+            telemetry.log(DISTANCE, side_prox)
 
             ignore_d = False
             # Have we crossed over the middle of the course?
             if side_prox > 350 and (side_prox-100 > prev_prox) and self.switched_wall == False:
-                print("Distance above threshold, follow right")
+                telemetry.log(SWITCH_WALL)
                 self.follow_left = False
                 self.switched_wall = True
                 # Tell PID not to wig out too much
@@ -158,13 +205,29 @@ class WallFollower:
 
             leftspeed, rightspeed = self.decide_speeds(min(side_prox, front_prox), ignore_d)
 
-            self.core.throttle(leftspeed, rightspeed)
-            print("Motors %f, %f" % (leftspeed, rightspeed))
+            actuate(leftspeed, rightspeed)
+            telemetry.log(MOTORS, leftspeed, rightspeed)
+
+            if recorder:
+                recorder.record(
+                    self.ticks, self.pidc.current_time,
+                    (d_left, d_front_raw, d_right),
+                    (self.pidc.PTerm, self.pidc.ITerm,
+                     self.pidc.DTerm, self.pidc.output),
+                    (leftspeed, rightspeed))
 
             self.ticks = self.ticks + 1
-            time.sleep(0.1)
+            self.executor.wait()
 
         print("Ticks %d" % self.ticks)
+        print("Timing: %s" % self.executor.summary())
+
+        if worker:
+            worker.stop()
+            print("Actuation: %d sent, %d dropped" % (worker.sent, worker.dropped))
+
+        if recorder:
+            recorder.close()
 
         self.core.stop()
 
@@ -172,11 +235,12 @@ class WallFollower:
 if __name__ == "__main__":
     core = core.Core()
     follower = WallFollower(core)
+    follower.record_path = time.strftime("run-%Y%m%d-%H%M%S.bin")
     try:
         follower.run()
     except (KeyboardInterrupt) as e:
         # except (Exception, KeyboardInterrupt) as e:
         # Stop any active threads before leaving
         follower.stop()
-        core.stop()
+        core.shutdown()
         print("Quitting")
@@ -0,0 +1,103 @@
+import numpy as np
+
+from lidar_filter import OUT_OF_RANGE
+
+# Rough figures for the robot
+MAX_SPEED = 1000.0  # mm/s at full throttle
+# Effective distance between the wheels (mm). Much wider than the real
+# thing, since skid steering loses a lot of the turn to wheel slip.
+TRACK_WIDTH = 400.0
+
+
+class WallPlant():
+    """ Kinematic model of the robot driving along the left hand wall,
+        for any number of robots at once: each attribute is an array with
+        one element per robot.
+
+        The state is the distance from the robot to the wall (mm) and its
+        heading relative to the wall (radians, positive towards the wall).
+        Speeds are as given to Core.throttle, [-1, 1] with negative being
+        forwards. Turning follows the robot as wired: the left speed more
+        negative than the right turns towards the wall. """
+
+    def __init__(self, count, distance=300.0, heading=0.0,
+                 max_speed=MAX_SPEED, track_width=TRACK_WIDTH):
+        """ Constructor """
+        self.max_speed = max_speed
+        self.track_width = track_width
+        self.distance = np.full(count, distance, dtype=float)
+        self.heading = np.full(count, heading, dtype=float)
+        self.rate = np.zeros(count)  # Of the distance, mm/s
+
+    def step(self, left_speed, right_speed, dt):
+        """ Drive at the given speeds (scalars or arrays) for dt seconds. """
+        forward = -(left_speed + right_speed) / 2.0 * self.max_speed
+        turn = (right_speed - left_speed) * self.max_speed / self.track_width
+        self.heading += turn * dt
+        self.rate = -forward * np.sin(self.heading)
+        self.distance += self.rate * dt
+
+    def measure(self):
+        """ What the side lidar sees: the distance along its beam, which
+            lengthens as the robot turns away from square to the wall. """
+        return self.distance / np.maximum(np.cos(self.heading), 0.1)
+
+
+class PlantCore():
+    """ Stands in for core.Core, driving a single WallPlant robot in
+        simulated time so that challenges can run off the robot. Each
+        throttle() call moves the robot on by dt seconds.
+
+        The left lidar sees the wall being followed, the right one the
+        far side of a corridor_width wide corridor and the front one
+        nothing in range. """
+
+    def __init__(self, distance=300.0, heading=0.0, dt=0.01,
+                 corridor_width=600.0, noise=0.0, seed=0):
+        """ Constructor """
+        self.plant = WallPlant(1, distance, heading)
+        self.dt = dt
+        self.corridor_width = corridor_width
+        self.noise = noise
+        self.random = np.random.RandomState(seed)
+        self.ticks = 0
+        self.commands = []
+
+    def enable_motors(self, enable):
+        pass
+
+    def read_sensor(self, pin, with_age=False):
+        if pin == 0:
+            distance = self.plant.measure()[0]
+        elif pin == 2:
+            distance = self.corridor_width - self.plant.distance[0]
+        else:
+            distance = float(OUT_OF_RANGE)
+        if self.noise:
+            distance += self.random.normal(0.0, self.noise)
+        if with_age:
+            return distance, 0.0
+        return distance
+
+    def read_filtered(self, pin):
+        distance = self.read_sensor(pin)
+        rate = 0.0
+        if pin == 0:
+            rate = self.plant.rate[0]
+        elif pin == 2:
+            rate = -self.plant.rate[0]
+        return distance, rate, distance < OUT_OF_RANGE
+
+    def throttle(self, left_speed, right_speed):
+        self.commands.append((left_speed, right_speed))
+        self.plant.step(left_speed, right_speed, self.dt)
+        self.ticks += 1
+
+    def direct_speed(self, left_speed, right_speed):
+        self.throttle(left_speed, right_speed)
+
+    def set_neutral(self):
+        pass
+
+    def stop(self):
+        pass
@@ -1,6 +1,7 @@
-import cwiid
 import logging
 
+from hardware import cwiid
+
 from numpy import clip, interp
 
 